@@ -0,0 +1,173 @@
+import time
+from typing import Any, Callable, Iterator, Union
+
+import numpy as np
+import torch
+
+
+class ThroughputMeter:
+    """It keeps throughput counters of an embedding run.
+
+    * Real tokens are the residues and special tokens of each sequence,
+    padded tokens are what the model actually processes after padding
+    every sequence of a batch to its longest member."""
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.n_seqs = 0
+        self.n_batches = 0
+        self.n_tokens = 0
+        self.n_padded_tokens = 0
+        self.seconds = 0.0
+
+    def update(self, n_seqs: int, n_tokens: int, n_padded_tokens: int, seconds: float) -> None:
+        self.n_seqs += n_seqs
+        self.n_batches += 1
+        self.n_tokens += n_tokens
+        self.n_padded_tokens += n_padded_tokens
+        self.seconds += seconds
+
+    @property
+    def seqs_per_sec(self) -> float:
+        return self.n_seqs / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.n_tokens / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def padding_ratio(self) -> float:
+        """Fraction of processed tokens that are only padding."""
+        if self.n_padded_tokens == 0:
+            return 0.0
+        return 1.0 - self.n_tokens / self.n_padded_tokens
+
+    def __repr__(self) -> str:
+        return (f"ThroughputMeter(seqs={self.n_seqs}, batches={self.n_batches}, "
+                f"seqs/s={self.seqs_per_sec:.2f}, tokens/s={self.tokens_per_sec:.1f}, "
+                f"padding={self.padding_ratio:.1%})")
+
+
+def length_batches(
+        lengths: np.ndarray,
+        max_tokens: int,
+        max_batch_size: int,
+) -> list[np.ndarray]:
+    """It groups sequences into micro-batches under a token budget.
+
+    * Sequences are sorted by length, so that the members of one batch
+    have similar lengths and little compute is wasted on padding.
+    * A batch is closed once (batch size x longest length) would exceed
+    max_tokens. A sequence longer than the budget forms its own batch.
+
+    Args:
+      - lengths: token lengths of the sequences (special tokens included)
+      - max_tokens: the upper bound of padded tokens in one batch
+      - max_batch_size: the upper bound of sequences in one batch
+
+    Returns: a list of index arrays into the original sequence order."""
+
+    if max_tokens <= 0 or max_batch_size <= 0:
+        raise ValueError("max_tokens and max_batch_size should be positive")
+
+    order = np.argsort(lengths, kind="stable")
+    batches: list[np.ndarray] = []
+    start = 0
+
+    for end in range(1, len(order) + 1):
+        if end == len(order):
+            batches.append(order[start:end])
+            break
+
+        # order is ascending, so the next sequence is the longest of the batch
+        size = end + 1 - start
+        longest = lengths[order[end]]
+        if size > max_batch_size or size * longest > max_tokens:
+            batches.append(order[start:end])
+            start = end
+
+    return batches
+
+
+class BatchEngine:
+    """It runs an embedding function over length-bucketed micro-batches.
+
+    * The forward function receives a list of sequences and returns one
+    embedding row per sequence. The results are put back into the
+    original order of the caller."""
+
+    def __init__(
+            self,
+            forward_fn: Callable[..., Any],
+            n_special_tokens: int,
+            max_tokens: int = 8192,
+            max_batch_size: int = 64,
+    ) -> None:
+
+        """
+        Args:
+          - forward_fn: a function computing embeddings of one micro-batch
+          - n_special_tokens: the number of tokens the tokenizer adds per sequence
+          - max_tokens: the upper bound of padded tokens in one batch
+          - max_batch_size: the upper bound of sequences in one batch"""
+
+        self.forward_fn = forward_fn
+        self.n_special_tokens = n_special_tokens
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.meter = ThroughputMeter()
+
+    def iter_batches(self, prot_seqs: list[str], **kwargs) -> Iterator[tuple[np.ndarray, Any]]:
+        """It yields index arrays of micro-batches with their forward outputs.
+
+        * Extra keyword arguments are passed on to the forward function."""
+
+        if len(prot_seqs) == 0:
+            raise ValueError("No protein sequence is given")
+
+        lengths = np.array([len(seq) for seq in prot_seqs]) + self.n_special_tokens
+        batches = length_batches(lengths, self.max_tokens, self.max_batch_size)
+
+        for batch in batches:
+            start = time.perf_counter()
+            output = self.forward_fn([prot_seqs[i] for i in batch], **kwargs)
+
+            batch_lens = lengths[batch]
+            self.meter.update(
+                n_seqs=len(batch),
+                n_tokens=int(batch_lens.sum()),
+                n_padded_tokens=int(batch_lens.max()) * len(batch),
+                seconds=time.perf_counter() - start,
+            )
+            yield batch, output
+
+    def run(self, prot_seqs: list[str], **kwargs) -> Union[torch.Tensor, dict[str, torch.Tensor]]:
+        """It computes embeddings of all sequences batch by batch.
+
+        * The forward function can return a tensor or a dict of tensors,
+        both are returned in the same form."""
+
+        indices, outputs = [], []
+        for batch, output in self.iter_batches(prot_seqs, **kwargs):
+            indices.append(batch)
+            if isinstance(output, dict):
+                outputs.append({name: embeds.cpu() for name, embeds in output.items()})
+            else:
+                outputs.append(output.cpu())
+
+        if isinstance(outputs[0], dict):
+            return {name: scatter_batches(indices, [output[name] for output in outputs])
+                    for name in outputs[0]}
+        return scatter_batches(indices, outputs)
+
+
+def scatter_batches(indices: list[np.ndarray], outputs: list[torch.Tensor]) -> torch.Tensor:
+    """It puts the rows of batch outputs back into caller's order."""
+
+    order = torch.from_numpy(np.concatenate(indices))
+    sorted_embeds = torch.cat(outputs)
+    embeds = torch.empty_like(sorted_embeds)
+    embeds[order] = sorted_embeds
+    return embeds
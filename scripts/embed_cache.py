@@ -0,0 +1,188 @@
+import hashlib
+import sqlite3
+import time
+from typing import Callable, Optional
+
+import numpy as np
+import torch
+
+from utils import clean_sequence
+
+
+class EmbeddingCache:
+    """It defines a persistent, content-addressed store of embeddings.
+
+    * Each embedding is keyed by checkpoint name, pooling mode and SHA-256
+    of the cleaned sequence, so that a renamed gene does not trigger a new
+    computation, while an edited sequence or another model does.
+    * Entries live in a SQLite file. Several processes can read and write
+    the same store; SQLite serializes the writers.
+    * If max_bytes is given, least recently used entries are evicted once
+    the store grows beyond it."""
+
+    # SQLite limits the number of host parameters of one statement
+    chunk_size = 500
+
+    def __init__(self, db_dir: str, max_bytes: Optional[int] = None, timeout: float = 60.0) -> None:
+        """
+        Args:
+          - db_dir: the directory of sqlite file of the store
+          - max_bytes: the upper bound of total embedding bytes in the store
+          - timeout: seconds to wait for the lock of another writer"""
+
+        self.db_dir = db_dir
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(db_dir, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeds ("
+                " key TEXT PRIMARY KEY,"
+                " dtype TEXT NOT NULL,"
+                " shape TEXT NOT NULL,"
+                " data BLOB NOT NULL,"
+                " nbytes INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeds_access ON embeds(last_access)")
+
+    @staticmethod
+    def make_key(ckpt_name: str, pooling: str, seq: str) -> str:
+        """It returns the content address of one embedding."""
+        seq_hash = hashlib.sha256(clean_sequence(seq).encode()).hexdigest()
+        return f"{ckpt_name}|{pooling}|{seq_hash}"
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """It returns the stored embeddings of given keys, skipping misses."""
+
+        found: dict[str, np.ndarray] = {}
+        for i in range(0, len(keys), self.chunk_size):
+            chunk = keys[i:i + self.chunk_size]
+            marks = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, dtype, shape, data FROM embeds WHERE key IN ({marks})",
+                chunk,
+            ).fetchall()
+
+            for key, dtype, shape, data in rows:
+                shape = tuple(int(s) for s in shape.split(",") if s)
+                found[key] = np.frombuffer(data, dtype=dtype).reshape(shape)
+
+        # refreshing access times for LRU eviction
+        if found:
+            now = time.time()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE embeds SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+        return found
+
+    def put_many(self, keys: list[str], embeds: np.ndarray) -> None:
+        """It writes embeddings into the store in one transaction."""
+
+        now = time.time()
+        rows = []
+        for key, embed in zip(keys, embeds):
+            embed = np.ascontiguousarray(embed)
+            shape = ",".join(str(s) for s in embed.shape)
+            rows.append((key, embed.dtype.str, shape, embed.tobytes(), embed.nbytes, now))
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeds VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.evict()
+
+    def evict(self) -> None:
+        """It deletes least recently used entries beyond max_bytes."""
+
+        if self.max_bytes is None:
+            return
+
+        with self.conn:
+            total = self.conn.execute(
+                "SELECT COALESCE(SUM(nbytes), 0) FROM embeds").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            excess = total - self.max_bytes
+            rows = self.conn.execute(
+                "SELECT key, nbytes FROM embeds ORDER BY last_access ASC")
+
+            victims = []
+            for key, nbytes in rows:
+                if excess <= 0:
+                    break
+                victims.append((key,))
+                excess -= nbytes
+            self.conn.executemany("DELETE FROM embeds WHERE key = ?", victims)
+
+    def embed(
+            self,
+            ckpt_name: str,
+            pooling: str,
+            prot_seqs: list[str],
+            compute_fn: Callable[[list[str]], torch.Tensor],
+    ) -> torch.Tensor:
+        """It returns embeddings of sequences, computing only the missing ones.
+
+        * Sequences which are absent in the store (new or edited ones) are
+        sent to compute_fn once, and their embeddings are saved.
+
+        Args:
+          - ckpt_name: the checkpoint name of the model
+          - pooling: the pooling mode of embeddings ("mean", "cls", ...)
+          - prot_seqs: the amino acid sequences of proteins
+          - compute_fn: a function computing embeddings of a list of sequences"""
+
+        embeds = self.embed_many(
+            ckpt_name, [pooling], prot_seqs, lambda seqs: {pooling: compute_fn(seqs)})
+        return embeds[pooling]
+
+    def embed_many(
+            self,
+            ckpt_name: str,
+            poolings: list[str],
+            prot_seqs: list[str],
+            compute_fn: Callable[[list[str]], dict[str, torch.Tensor]],
+    ) -> dict[str, torch.Tensor]:
+        """It returns embeddings of several poolings, computing missing ones.
+
+        * A sequence missing any of the poolings is sent to compute_fn,
+        which returns all poolings of it from one forward pass.
+
+        Args:
+          - ckpt_name: the checkpoint name of the model
+          - poolings: the pooling modes of embeddings
+          - prot_seqs: the amino acid sequences of proteins
+          - compute_fn: a function computing a dict of pooling -> embeddings"""
+
+        keys = {pooling: [EmbeddingCache.make_key(ckpt_name, pooling, seq) for seq in prot_seqs]
+                for pooling in poolings}
+        found = self.get_many(list({key for pooling_keys in keys.values() for key in pooling_keys}))
+
+        # each distinct missing sequence is computed only once
+        missing: dict[str, str] = {}
+        for i, seq in enumerate(prot_seqs):
+            seq_keys = [keys[pooling][i] for pooling in poolings]
+            if seq_keys[0] not in missing and any(key not in found for key in seq_keys):
+                missing[seq_keys[0]] = seq
+
+        if missing:
+            new_seqs = list(missing.values())
+            new_embeds = compute_fn(new_seqs)
+            for pooling in poolings:
+                new_keys = [EmbeddingCache.make_key(ckpt_name, pooling, seq) for seq in new_seqs]
+                embeds = new_embeds[pooling].cpu().numpy()
+                self.put_many(new_keys, embeds)
+                found.update(zip(new_keys, embeds))
+
+        return {pooling: torch.from_numpy(np.stack([found[key] for key in keys[pooling]]))
+                for pooling in poolings}
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM embeds").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
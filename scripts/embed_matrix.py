@@ -0,0 +1,136 @@
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from utils import load_embeds_pickle
+
+
+class EmbeddingMatrix:
+    """It defines a memory-mapped matrix of protein embeddings.
+
+    * Embeddings are kept as one contiguous [N, D] block in ".npy" format,
+    and the gene name and uniprot id of each row are kept in a sidecar
+    ".ids.tsv" file.
+    * The block is opened with np.memmap, so loading does not copy it, and
+    several processes reading the same file share one page-cached copy.
+    Only the selected rows are read from disk."""
+
+    def __init__(self, matrix_dir: str, mode: str = "r") -> None:
+        """
+        Args:
+          - matrix_dir: the path of embedding matrix without extension
+          - mode: memmap mode, "r" for read-only or "r+" to edit in place"""
+
+        self.matrix_dir = matrix_dir
+        self.matrix = np.load(f"{matrix_dir}.npy", mmap_mode=mode)
+
+        index = pd.read_csv(
+            f"{matrix_dir}.ids.tsv",
+            sep="\t",
+            dtype=str,
+            na_filter=False,
+            keep_default_na=False
+        )
+
+        if len(index) != len(self.matrix):
+            raise ValueError("Embedding matrix and its id index have different sizes")
+
+        self.genes = index["Gene"].to_numpy()
+        self.uniprot_ids = index["ID"].to_numpy()
+        self.gene_rows = {gene: i for i, gene in enumerate(self.genes) if gene != ""}
+        self.id_rows = {uid: i for i, uid in enumerate(self.uniprot_ids) if uid != ""}
+
+    @staticmethod
+    def write(
+            matrix_dir: str,
+            embeds,
+            genes: list[str],
+            uniprot_ids: Optional[list[str]] = None,
+            dtype: type = np.float32,
+    ) -> "EmbeddingMatrix":
+
+        """It writes embeddings into a memory-mappable matrix.
+
+        * Rows are written one by one into the memory-mapped file, so that
+        embeds can be any iterable of vectors without an extra copy.
+
+        Args:
+          - matrix_dir: the path of embedding matrix without extension
+          - embeds: a sequence of N embedding vectors of the same size
+          - genes: the gene names of N rows
+          - uniprot_ids: the uniprot ids of N rows, if they are known
+          - dtype: np.float32 or np.float16 to halve the size on disk"""
+
+        if uniprot_ids is None:
+            uniprot_ids = [""] * len(genes)
+        if len(uniprot_ids) != len(genes):
+            raise ValueError("genes and uniprot_ids should have the same length")
+
+        rows = iter(embeds)
+        first = np.asarray(next(rows))
+        shape = (len(genes), first.shape[-1])
+
+        matrix = np.lib.format.open_memmap(
+            f"{matrix_dir}.npy", mode="w+", dtype=dtype, shape=shape)
+        matrix[0] = first
+        n_rows = 1
+        for embed in rows:
+            matrix[n_rows] = embed
+            n_rows += 1
+
+        if n_rows != len(genes):
+            raise ValueError("The number of embeddings and genes do not match")
+
+        matrix.flush()
+        del matrix
+
+        index = pd.DataFrame({"Gene": genes, "ID": uniprot_ids})
+        index.to_csv(f"{matrix_dir}.ids.tsv", sep="\t", index=False)
+        return EmbeddingMatrix(matrix_dir)
+
+    @staticmethod
+    def from_pickle(
+            source_dir: str,
+            file_name: str,
+            matrix_dir: str,
+            dtype: type = np.float32,
+    ) -> "EmbeddingMatrix":
+
+        """It converts a gene to embedding pickle into a matrix file."""
+
+        embeds = load_embeds_pickle(source_dir, file_name)
+        return EmbeddingMatrix.write(
+            matrix_dir, embeds.values(), list(embeds.keys()), dtype=dtype)
+
+    @staticmethod
+    def exists(matrix_dir: str) -> bool:
+        return os.path.exists(f"{matrix_dir}.npy") and os.path.exists(f"{matrix_dir}.ids.tsv")
+
+    def rows(self, keys: list[str], by: str = "Gene") -> np.ndarray:
+        """It returns the embeddings of given genes or uniprot ids.
+
+        Args:
+          - keys: gene names or uniprot ids
+          - by: "Gene" or "ID" to choose the type of keys"""
+
+        if by == "Gene":
+            lookup = self.gene_rows
+        elif by == "ID":
+            lookup = self.id_rows
+        else:
+            raise ValueError("by should be either Gene or ID")
+
+        missing = [key for key in keys if key not in lookup]
+        if missing:
+            raise ValueError(f"Invalid keys for embedding matrix: {missing[:5]}")
+
+        return self.matrix[[lookup[key] for key in keys]]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.matrix)
@@ -1,4 +1,6 @@
-import re
+from functools import partial
+from typing import Optional
+
 import torch
 from transformers import (
     T5Tokenizer,
@@ -7,84 +9,211 @@ from transformers import (
     BertModel,
 )
 
+from batching import BatchEngine
+from embed_cache import EmbeddingCache
+from fast_tokenizer import ResidueTokenizer, hf_tokenize
+from inference import autocast_context, prepare_model
+from pooling import check_poolings, embed_poolings, pool_hidden
+
 
 class ProtT5Embedder:
     """It builds Prot T5 XL Uniref 50 Model for protein embeddings."""
-    def __init__(self, device: str) -> None:
+
+    checkpoint = "Rostlab/prot_t5_xl_half_uniref50-enc"
+
+    def __init__(
+            self,
+            device: str,
+            max_tokens: int = 8192,
+            max_batch_size: int = 64,
+            cache: Optional[EmbeddingCache] = None,
+            precision: str = "fp32",
+            compile_model: bool = False,
+            fast_tokenizer: bool = True,
+    ) -> None:
+        """
+        Args:
+          - device: the device to run the model on ("cpu" or "cuda")
+          - max_tokens: the upper bound of padded tokens in one micro-batch
+          - max_batch_size: the upper bound of sequences in one micro-batch
+          - cache: an embedding store to skip already computed sequences
+          - precision: "fp32", "bf16" or "int8", see inference.prepare_model
+          - compile_model: if True, the model is compiled with torch.compile
+          - fast_tokenizer: if True, residues are tokenized by a lookup table"""
+
         self.device = device
-        ckpt_name = "Rostlab/prot_t5_xl_half_uniref50-enc"
+        self.cache = cache
+        self.precision = precision
+        ckpt_name = self.checkpoint
+
+        # cached embeddings of reduced precisions are kept apart
+        self.ckpt_name = ckpt_name if precision == "fp32" else f"{ckpt_name}@{precision}"
         self.tokenizer = T5Tokenizer.from_pretrained(ckpt_name, do_lower_case=False)
+        self.tokenize = ResidueTokenizer(self.tokenizer) if fast_tokenizer \
+            else partial(hf_tokenize, self.tokenizer)
         self.model = T5EncoderModel.from_pretrained(ckpt_name).to(device)
+        self.model = prepare_model(self.model, device, precision, compile_model)
 
-        if self.device == "cpu":
-            self.model.to(torch.float32)
+        # T5 tokenizer appends one </s> token to each sequence
+        self.engine = BatchEngine(self._forward, 1, max_tokens, max_batch_size)
 
     def compute_embeds(self, prot_seqs: list[str]) -> torch.Tensor:
         """It compute embeddings of protein sequences.
+
+        * Sequences are processed in length-bucketed micro-batches, and
+        the embeddings are returned on cpu in the order of prot_seqs.
+        Throughput counters are kept in self.engine.meter.
+        * If a cache is given, only new or edited sequences reach the model.
+
         Args:
           - prot_seqs: the amino acid sequences of proteins"""
 
-        seqs = [" ".join(list(re.sub(r"[UZOB]", "X", seq))) for seq in prot_seqs]
-        ids = self.tokenizer(seqs, padding="longest", return_tensors="pt")
+        return self.embed(prot_seqs, ["mean"])["mean"]
+
+    def embed(
+            self,
+            prot_seqs: list[str],
+            poolings: list[str] = ("mean",),
+            residue_dir: Optional[str] = None,
+    ) -> dict[str, torch.Tensor]:
+
+        """It computes several poolings of protein sequences at once.
+
+        * The model runs once per micro-batch for all poolings.
+
+        Args:
+          - prot_seqs: the amino acid sequences of proteins
+          - poolings: "mean", "max" and "residue" (no cls token in T5)
+          - residue_dir: the directory of streamed per-residue embeddings
+
+        Returns: a dict of pooling -> embeddings in [N, D] shape, residue
+        embeddings are read with ResidueWriter.load(residue_dir)"""
+
+        check_poolings(poolings, has_cls=False)
+        return embed_poolings(self.engine, prot_seqs, list(poolings), residue_dir,
+                              self.cache, self.ckpt_name)
+
+    def _forward(self, prot_seqs: list[str], poolings: list[str] = ("mean",)) -> dict:
+        """It runs the model on one micro-batch of sequences."""
+
+        ids = self.tokenize(prot_seqs)
 
         for k, v in ids.items():
             ids[k] = v.to(self.device)
 
-        with torch.no_grad():
+        with torch.no_grad(), autocast_context(self.device, self.precision):
             output = self.model(**ids)
 
-        embeds = []
-        for i , seq in enumerate(prot_seqs):
-            embed = output.last_hidden_state[i, :len(seq)].mean(dim=0)
-            embeds.append(embed)
-
-        return torch.stack(embeds)
+        # residues come before the </s> token
+        hidden = output.last_hidden_state
+        lengths = torch.tensor([len(seq) for seq in prot_seqs], device=hidden.device)
+        positions = torch.arange(hidden.shape[1], device=hidden.device)
+        residue_mask = positions[None, :] < lengths[:, None]
+        return pool_hidden(hidden, residue_mask, poolings)
 
 
 class ProtTransEmbedder:
     """It builds ProtBert Model for protein embeddings."""
-    def __init__(self, device: str) -> None:
+
+    checkpoint = "Rostlab/prot_bert"
+
+    def __init__(
+            self,
+            device: str,
+            max_tokens: int = 8192,
+            max_batch_size: int = 64,
+            cache: Optional[EmbeddingCache] = None,
+            precision: str = "fp32",
+            compile_model: bool = False,
+            fast_tokenizer: bool = True,
+    ) -> None:
+        """
+        Args:
+          - device: the device to run the model on ("cpu" or "cuda")
+          - max_tokens: the upper bound of padded tokens in one micro-batch
+          - max_batch_size: the upper bound of sequences in one micro-batch
+          - cache: an embedding store to skip already computed sequences
+          - precision: "fp32", "bf16" or "int8", see inference.prepare_model
+          - compile_model: if True, the model is compiled with torch.compile
+          - fast_tokenizer: if True, residues are tokenized by a lookup table"""
+
         self.device = device
-        ckpt_name = "Rostlab/prot_bert"
+        self.cache = cache
+        self.precision = precision
+        ckpt_name = self.checkpoint
+
+        # cached embeddings of reduced precisions are kept apart
+        self.ckpt_name = ckpt_name if precision == "fp32" else f"{ckpt_name}@{precision}"
         self.tokenizer = BertTokenizer.from_pretrained(ckpt_name, do_lower_case=False)
+        self.tokenize = ResidueTokenizer(self.tokenizer) if fast_tokenizer \
+            else partial(hf_tokenize, self.tokenizer)
         self.model = BertModel.from_pretrained(ckpt_name).to(device)
+        self.model = prepare_model(self.model, device, precision, compile_model)
 
-        if self.device == "cpu":
-            self.model.to(torch.float32)
+        # Bert tokenizer adds [CLS] and [SEP] tokens to each sequence
+        self.engine = BatchEngine(self._forward, 2, max_tokens, max_batch_size)
 
     def compute_res_embeds(self, prot_seqs: list[str]) -> torch.Tensor:
         """It compute mean residue embeddings of protein sequences.
+
+        * Sequences are processed in length-bucketed micro-batches, and
+        the embeddings are returned on cpu in the order of prot_seqs.
+        Throughput counters are kept in self.engine.meter.
+        * If a cache is given, only new or edited sequences reach the model.
+
         Args:
           - prot_seqs: the amino acid sequences of proteins"""
 
-        seqs = [" ".join(list(re.sub(r"[UZOB]", "X", seq))) for seq in prot_seqs]
-        ids = self.tokenizer(seqs, padding="longest", return_tensors="pt")
+        return self.embed(prot_seqs, ["mean"])["mean"]
 
-        for k, v in ids.items():
-            ids[k] = v.to(self.device)
+    def get_cls_embeds(self, prot_seqs: list[str]) -> torch.Tensor:
+        """It compute cls embeddings of protein sequences.
 
-        with torch.no_grad():
-            output = self.model(**ids)
+        * To get both mean and cls embeddings, use embed, which runs the
+        model only once.
+
+        Args:
+          - prot_seqs: the amino acid sequences of proteins"""
 
-        embeds = []
-        for i , seq in enumerate(prot_seqs):
-            embed = output.last_hidden_state[i, 1:len(seq) + 1].mean(dim=0)
-            embeds.append(embed)
+        return self.embed(prot_seqs, ["cls"])["cls"]
 
-        return torch.stack(embeds)
+    def embed(
+            self,
+            prot_seqs: list[str],
+            poolings: list[str] = ("mean",),
+            residue_dir: Optional[str] = None,
+    ) -> dict[str, torch.Tensor]:
+
+        """It computes several poolings of protein sequences at once.
+
+        * The model runs once per micro-batch for all poolings.
 
-    def get_cls_embeds(self, prot_seqs: list[str]) -> torch.Tensor:
-        """It compute cls embeddings of protein sequences.
         Args:
-          - prot_seqs: the amino acid sequences of proteins"""
+          - prot_seqs: the amino acid sequences of proteins
+          - poolings: "mean", "cls", "max" and "residue"
+          - residue_dir: the directory of streamed per-residue embeddings
+
+        Returns: a dict of pooling -> embeddings in [N, D] shape, residue
+        embeddings are read with ResidueWriter.load(residue_dir)"""
+
+        check_poolings(poolings, has_cls=True)
+        return embed_poolings(self.engine, prot_seqs, list(poolings), residue_dir,
+                              self.cache, self.ckpt_name)
+
+    def _forward(self, prot_seqs: list[str], poolings: list[str] = ("mean",)) -> dict:
+        """It runs the model on one micro-batch of sequences."""
 
-        seqs = [" ".join(list(re.sub(r"[UZOB]", "X", seq))) for seq in prot_seqs]
-        ids = self.tokenizer(seqs, padding="longest", return_tensors="pt")
+        ids = self.tokenize(prot_seqs)
 
         for k, v in ids.items():
             ids[k] = v.to(self.device)
 
-        with torch.no_grad():
+        with torch.no_grad(), autocast_context(self.device, self.precision):
             output = self.model(**ids)
 
-        return output.last_hidden_state[:, 0, :]
+        # residues lie between [CLS] and [SEP] tokens
+        hidden = output.last_hidden_state
+        lengths = torch.tensor([len(seq) for seq in prot_seqs], device=hidden.device)
+        positions = torch.arange(hidden.shape[1], device=hidden.device)
+        residue_mask = (positions[None, :] >= 1) & (positions[None, :] <= lengths[:, None])
+        return pool_hidden(hidden, residue_mask, poolings)
@@ -0,0 +1,105 @@
+import string
+
+import numpy as np
+import torch
+
+from utils import clean_sequence
+
+
+def hf_tokenize(tokenizer, prot_seqs: list[str]) -> dict[str, torch.Tensor]:
+    """It tokenizes sequences the slow way, as the embedders always did."""
+    seqs = [" ".join(list(clean_sequence(seq))) for seq in prot_seqs]
+    return dict(tokenizer(seqs, padding="longest", return_tensors="pt"))
+
+
+class ResidueTokenizer:
+    """It maps residue bytes straight to vocabulary ids of a tokenizer.
+
+    * A 256-entry lookup table gives the token id of each byte; it is
+    built by tokenizing every ASCII letter alone with the
+    HuggingFace tokenizer, so rare amino acids (U, Z, O, B) map to the id
+    of X as clean_sequence does. Other bytes are -1.
+    * A batch is encoded with one table lookup over the concatenated
+    bytes of its sequences, and one scatter into padded input_ids.
+    * Batches with unsupported characters fall back to hf_tokenize, so the
+    output always equals that of HuggingFace tokenizer; verify checks
+    this on a probe batch when the tokenizer is created."""
+
+    def __init__(self, tokenizer) -> None:
+        self.tokenizer = tokenizer
+        self.lut = np.full(256, -1, dtype=np.int64)
+
+        for char in string.ascii_letters:
+            ids = tokenizer(clean_sequence(char), add_special_tokens=False)["input_ids"]
+            if len(ids) == 1:
+                self.lut[ord(char)] = ids[0]
+
+        # special tokens around residues, e.g. [CLS] ... [SEP] or ... </s>
+        core = int(self.lut[ord("A")])
+        ids = tokenizer("A")["input_ids"]
+        if ids.count(core) != 1:
+            raise ValueError("Tokenizer should encode one residue as one token")
+        self.prefix = np.array(ids[:ids.index(core)], dtype=np.int64)
+        self.suffix = np.array(ids[ids.index(core) + 1:], dtype=np.int64)
+
+        self.pad_id = tokenizer.pad_token_id
+        self.input_names = tokenizer.model_input_names
+
+        probe = ["ACDEFGHIKLMNPQRSTVWYXUZOB", "MKV", "GGSUB" * 7]
+        if not self.verify(probe):
+            raise ValueError("Fast tokenizer does not match HuggingFace tokenizer")
+
+    def encode(self, prot_seqs: list[str]):
+        """It returns padded tensors of sequences, or None if some
+        character is not supported by the lookup table."""
+
+        data = "".join(prot_seqs).encode()
+        lengths = np.array([len(seq) for seq in prot_seqs], dtype=np.int64)
+        if len(data) != lengths.sum():
+            return None  # multi-byte characters
+
+        codes = self.lut[np.frombuffer(data, dtype=np.uint8)]
+        if (codes < 0).any():
+            return None
+
+        n_prefix, n_suffix = len(self.prefix), len(self.suffix)
+        n_seqs = len(prot_seqs)
+        token_lens = lengths + n_prefix + n_suffix
+        input_ids = np.full((n_seqs, int(token_lens.max())), self.pad_id, dtype=np.int64)
+
+        # position of each residue in its padded row
+        starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+        rows = np.repeat(np.arange(n_seqs), lengths)
+        cols = np.arange(len(codes)) - starts + n_prefix
+        input_ids[rows, cols] = codes
+
+        input_ids[:, :n_prefix] = self.prefix
+        if n_suffix:
+            suffix_cols = (lengths + n_prefix)[:, None] + np.arange(n_suffix)
+            input_ids[np.arange(n_seqs)[:, None], suffix_cols] = self.suffix
+
+        attention_mask = np.arange(input_ids.shape[1])[None, :] < token_lens[:, None]
+
+        ids = {"input_ids": torch.from_numpy(input_ids)}
+        if "token_type_ids" in self.input_names:
+            ids["token_type_ids"] = torch.zeros_like(ids["input_ids"])
+        ids["attention_mask"] = torch.from_numpy(attention_mask.astype(np.int64))
+        return ids
+
+    def __call__(self, prot_seqs: list[str]) -> dict[str, torch.Tensor]:
+        ids = self.encode(prot_seqs)
+        if ids is None:
+            return hf_tokenize(self.tokenizer, prot_seqs)
+        return ids
+
+    def verify(self, prot_seqs: list[str]) -> bool:
+        """It checks that fast and HuggingFace tokenizers give equal tensors."""
+
+        fast = self.encode(prot_seqs)
+        if fast is None:
+            return False
+
+        reference = hf_tokenize(self.tokenizer, prot_seqs)
+        if set(fast) != set(reference):
+            return False
+        return all(torch.equal(fast[name], reference[name].to(torch.int64)) for name in fast)
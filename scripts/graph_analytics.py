@@ -0,0 +1,219 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+
+def pagerank(
+        adjmat: sp.csr_matrix,
+        personalization: Optional[np.ndarray] = None,
+        alpha: float = 0.85,
+        tol: float = 1e-8,
+        max_iter: int = 100,
+) -> np.ndarray:
+
+    """ It computes (personalized) PageRank by power iteration.
+
+    * Random walks follow edges in proportion to their weights, and jump
+    back to personalization distribution with probability 1 - alpha. Rank
+    of dangling nodes (without edges) is also sent back to it.
+
+    Args:
+      - adjmat: weighted adjacency matrix in [N, N] shape
+      - personalization: restart distribution, uniform by default
+      - alpha: the probability of following an edge
+      - tol: L1 change of ranks to stop the iteration
+      - max_iter: the upper bound of iterations"""
+
+    n = adjmat.shape[0]
+    if n == 0:
+        return np.zeros(0)
+
+    if personalization is None:
+        restart = np.full(n, 1.0 / n)
+    else:
+        restart = np.asarray(personalization, dtype=np.float64)
+        if restart.sum() <= 0:
+            raise ValueError("Personalization should have a positive sum")
+        restart = restart / restart.sum()
+
+    out_weight = np.asarray(adjmat.sum(axis=1)).ravel()
+    dangling = out_weight == 0
+    inv_weight = np.zeros(n)
+    inv_weight[~dangling] = 1.0 / out_weight[~dangling]
+
+    # transposed transition matrix: rank flows along normalized rows
+    transition_t = (sp.diags(inv_weight) @ adjmat).T.tocsr()
+
+    ranks = restart.copy()
+    for _ in range(max_iter):
+        dangling_mass = ranks[dangling].sum()
+        new_ranks = alpha * (transition_t @ ranks + dangling_mass * restart) + (1 - alpha) * restart
+        if np.abs(new_ranks - ranks).sum() < tol:
+            return new_ranks
+        ranks = new_ranks
+    return ranks
+
+
+def k_hop(adjmat: sp.csr_matrix, seeds: np.ndarray, k: int) -> np.ndarray:
+    """ It expands seed nodes by breadth first search up to k hops.
+
+    * Each hop expands the whole frontier at once through the rows of
+    adjacency matrix.
+
+    Returns: hop distances of nodes from the seeds, -1 for farther nodes"""
+
+    hops = np.full(adjmat.shape[0], -1, dtype=np.int32)
+    frontier = np.unique(np.asarray(seeds, dtype=np.int64))
+    hops[frontier] = 0
+
+    for hop in range(1, k + 1):
+        if len(frontier) == 0:
+            break
+        reached = np.unique(adjmat[frontier].indices)
+        frontier = reached[hops[reached] == -1]
+        hops[frontier] = hop
+    return hops
+
+
+def edge_costs(adjmat: sp.csr_matrix, cost: str) -> sp.csr_matrix:
+    """ It turns edge scores into positive path costs.
+
+    * "hops": every edge costs 1.
+    * "-log": an edge costs -log(score), so that the shortest path is the
+    most confident chain of associations."""
+
+    costs = adjmat.copy().astype(np.float64)
+    if cost == "hops":
+        costs.data[:] = 1.0
+    elif cost == "-log":
+        costs.data = -np.log(np.clip(costs.data, 1e-12, 1.0 - 1e-9))
+    else:
+        raise ValueError("Cost should be either hops or -log")
+    return costs
+
+
+def shortest_paths(
+        adjmat: sp.csr_matrix,
+        sources: np.ndarray,
+        cost: str = "hops",
+        min_only: bool = True,
+) -> tuple:
+
+    """ It computes shortest paths from many source nodes with Dijkstra.
+
+    Args:
+      - adjmat: weighted adjacency matrix in [N, N] shape
+      - sources: node ids of sources
+      - cost: "hops" or "-log" to turn scores into edge costs
+      - min_only: if True, distances to the nearest source are returned
+
+    Returns: distances and predecessors, in [N] shape if min_only, else
+    in [len(sources), N] shape. Unreachable nodes have inf distance."""
+
+    costs = edge_costs(adjmat, cost)
+    sources = np.asarray(sources, dtype=np.int64)
+
+    if min_only:
+        dists, preds, _ = csgraph.dijkstra(
+            costs, directed=False, indices=sources,
+            min_only=True, return_predecessors=True)
+        return dists, preds
+
+    return csgraph.dijkstra(
+        costs, directed=False, indices=sources, return_predecessors=True)
+
+
+def _brandes_sources(indptr: np.ndarray, indices: np.ndarray, sources: np.ndarray) -> np.ndarray:
+    """ It accumulates unweighted betweenness dependencies of some sources.
+
+    * For each source, a level-synchronous BFS counts shortest paths
+    (sigma) with sparse products, then dependencies flow back level by
+    level as in Brandes algorithm."""
+
+    n = len(indptr) - 1
+    adjmat = sp.csr_matrix(
+        (np.ones(len(indices)), indices, indptr), shape=(n, n))
+    betweenness = np.zeros(n)
+
+    for source in sources:
+        dist = np.full(n, -1, dtype=np.int64)
+        sigma = np.zeros(n)
+        dist[source] = 0
+        sigma[source] = 1.0
+
+        levels = [np.array([source])]
+        while True:
+            frontier = levels[-1]
+            paths = adjmat[frontier].T @ sigma[frontier]
+            new = np.flatnonzero((paths > 0) & (dist == -1))
+            if len(new) == 0:
+                break
+            dist[new] = len(levels)
+            sigma[new] = paths[new]
+            levels.append(new)
+
+        delta = np.zeros(n)
+        for depth in range(len(levels) - 1, 0, -1):
+            children, parents = levels[depth], levels[depth - 1]
+            coef = (1.0 + delta[children]) / sigma[children]
+            delta[parents] += sigma[parents] * (adjmat[parents][:, children] @ coef)
+
+        delta[source] = 0.0
+        betweenness += delta
+
+    return betweenness
+
+
+def sampled_betweenness(
+        adjmat: sp.csr_matrix,
+        n_samples: Optional[int] = None,
+        n_jobs: int = 1,
+        seed: int = 0,
+) -> np.ndarray:
+
+    """ It estimates betweenness centrality from sampled source nodes.
+
+    * Shortest paths are counted by hops. Dependencies of n_samples
+    random sources are summed and scaled up to all nodes; with
+    n_samples=None every node is a source and the result is exact.
+    * Sources are split across n_jobs worker processes; n_jobs <= 0
+    uses every core.
+
+    Returns: betweenness of nodes, normalized by (N-1)(N-2)/2 pairs"""
+
+    if not isinstance(n_jobs, (int, np.integer)) or isinstance(n_jobs, bool):
+        raise ValueError("The number of jobs should be an integer")
+
+    n = adjmat.shape[0]
+    if n < 3:
+        return np.zeros(n)
+
+    rng = np.random.default_rng(seed)
+    if n_samples is None or n_samples >= n:
+        sources = np.arange(n)
+    else:
+        sources = rng.choice(n, size=n_samples, replace=False)
+
+    adjmat = adjmat.tocsr()
+    indptr, indices = adjmat.indptr, adjmat.indices
+
+    if n_jobs <= 0:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = max(1, min(int(n_jobs), len(sources)))
+
+    if n_jobs == 1:
+        betweenness = _brandes_sources(indptr, indices, sources)
+    else:
+        chunks = np.array_split(sources, n_jobs)
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            parts = executor.map(
+                _brandes_sources, [indptr] * n_jobs, [indices] * n_jobs, chunks)
+            betweenness = sum(parts)
+
+    # each undirected pair is counted from both of its ends
+    betweenness = betweenness * (n / len(sources)) / 2.0
+    return betweenness / ((n - 1) * (n - 2) / 2.0)
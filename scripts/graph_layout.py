@@ -0,0 +1,215 @@
+import hashlib
+import html
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+
+def force_layout(
+        src: np.ndarray,
+        dst: np.ndarray,
+        weight: np.ndarray,
+        n_nodes: int,
+        n_iter: int = 100,
+        grid_size: int = 32,
+        seed: int = 7,
+        block_size: int = 2048,
+) -> np.ndarray:
+
+    """ It computes a force-directed layout of a sparse graph.
+
+    * This is Fruchterman-Reingold layout, where edges pull their ends
+    together in proportion to their weights and all nodes push each
+    other away.
+    * Attraction is computed over the edge list, so it costs O(E).
+    Repulsion is approximated Barnes-Hut style: nodes are binned into a
+    grid_size x grid_size grid, and each node is pushed by the mass
+    centers of grid cells instead of every other node, which costs
+    O(N x grid_size^2) instead of O(N^2) per iteration.
+
+    Args:
+      - src, dst, weight: edge arrays of the graph
+      - n_nodes: the number of nodes
+      - n_iter: the number of iterations
+      - grid_size: the number of grid cells along each axis
+      - seed: random seed of initial positions
+      - block_size: the number of nodes processed at once for repulsion
+
+    Returns: node positions in [n_nodes, 2] shape within the unit square"""
+
+    rng = np.random.default_rng(seed)
+    pos = rng.random((n_nodes, 2))
+    if n_nodes < 2:
+        return pos
+
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    weight = np.asarray(weight, dtype=np.float64)
+
+    k = np.sqrt(1.0 / n_nodes)  # ideal edge length in unit square
+    temperature = 0.1
+
+    for it in range(n_iter):
+        disp = np.zeros_like(pos)
+
+        # repulsion from mass centers of grid cells
+        low, high = pos.min(axis=0), pos.max(axis=0)
+        span = np.maximum(high - low, 1e-9)
+        cells = np.minimum(((pos - low) / span * grid_size).astype(np.int64), grid_size - 1)
+        cell_ids = cells[:, 0] * grid_size + cells[:, 1]
+
+        n_cells = grid_size * grid_size
+        mass = np.bincount(cell_ids, minlength=n_cells).astype(np.float64)
+        occupied = mass > 0
+        centers = np.stack([
+            np.bincount(cell_ids, weights=pos[:, 0], minlength=n_cells),
+            np.bincount(cell_ids, weights=pos[:, 1], minlength=n_cells),
+        ], axis=1)[occupied] / mass[occupied, None]
+        mass = mass[occupied]
+
+        for start in range(0, n_nodes, block_size):
+            block = pos[start:start + block_size]
+            delta = block[:, None, :] - centers[None, :, :]
+            dist2 = np.maximum((delta ** 2).sum(axis=2), (0.01 * k) ** 2)
+            disp[start:start + block_size] += (
+                k * k * (mass[None, :] / dist2)[:, :, None] * delta).sum(axis=1)
+
+        # attraction along weighted edges
+        delta = pos[src] - pos[dst]
+        dist = np.sqrt((delta ** 2).sum(axis=1)) + 1e-12
+        force = (weight * dist / k)[:, None] * delta
+        for axis in range(2):
+            disp[:, axis] -= np.bincount(src, weights=force[:, axis], minlength=n_nodes)
+            disp[:, axis] += np.bincount(dst, weights=force[:, axis], minlength=n_nodes)
+
+        # displacements are limited by a cooling temperature
+        length = np.sqrt((disp ** 2).sum(axis=1)) + 1e-12
+        step = np.minimum(length, temperature * (1.0 - it / n_iter))
+        pos += disp / length[:, None] * step[:, None]
+
+    # rescaling into unit square
+    pos -= pos.min(axis=0)
+    pos /= max(pos.max(), 1e-12)
+    return pos
+
+
+def layout_key(names: list[str], src: np.ndarray, dst: np.ndarray, weight: np.ndarray, **params) -> str:
+    """It returns a hash of a graph and layout parameters for caching."""
+
+    digest = hashlib.sha256()
+    digest.update("\n".join(names).encode())
+    for array in (src, dst, weight):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()[:16]
+
+
+def cached_force_layout(
+        names: list[str],
+        src: np.ndarray,
+        dst: np.ndarray,
+        weight: np.ndarray,
+        cache_dir: Optional[str] = None,
+        **params,
+) -> np.ndarray:
+
+    """It computes a force layout once and reuses it from cache_dir.
+
+    * Layouts are saved as "layout_<hash>.npy", where the hash covers node
+    names, edges and layout parameters."""
+
+    if cache_dir is None:
+        return force_layout(src, dst, weight, len(names), **params)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    key = layout_key(names, src, dst, weight, **params)
+    layout_dir = os.path.join(cache_dir, f"layout_{key}.npy")
+
+    if os.path.exists(layout_dir):
+        return np.load(layout_dir)
+
+    pos = force_layout(src, dst, weight, len(names), **params)
+    np.save(layout_dir, pos)
+    return pos
+
+
+html_template = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="https://unpkg.com/graphology@0.25.4/dist/graphology.umd.min.js"></script>
+<script src="https://unpkg.com/sigma@2.4.0/build/sigma.min.js"></script>
+<style>html, body, #graph {{ width: 100%; height: 100%; margin: 0; }}</style>
+</head>
+<body>
+<div id="graph"></div>
+<script id="graph-data" type="application/json">
+"""
+
+html_footer = """
+</script>
+<script>
+const data = JSON.parse(document.getElementById("graph-data").textContent);
+const graph = new graphology.Graph({type: "undirected", multi: false});
+const n = data.nodes.label.length;
+for (let i = 0; i < n; i++) {
+  graph.addNode(i, {
+    label: data.nodes.label[i], x: data.nodes.x[i], y: data.nodes.y[i],
+    size: data.nodes.size[i], color: data.nodes.color[i]
+  });
+}
+const e = data.edges;
+for (let i = 0; i < e.source.length; i++) {
+  graph.addEdge(e.source[i], e.target[i], {size: e.size[i], color: "#cccccc"});
+}
+new Sigma(graph, document.getElementById("graph"), {renderLabels: n < 2000});
+</script>
+</body>
+</html>
+"""
+
+
+def write_webgl_html(
+        html_dir: str,
+        title: str,
+        labels: list[str],
+        pos: np.ndarray,
+        colors: list[str],
+        src: np.ndarray,
+        dst: np.ndarray,
+        weight: np.ndarray,
+) -> None:
+
+    """It writes a graph into a self-contained WebGL (sigma.js) page.
+
+    * Nodes and edges are embedded as columnar JSON arrays, and written
+    one array at a time, so that no adjacency matrix is ever built.
+    * Edge widths are scaled by weights, node sizes by weighted degree."""
+
+    degree = np.bincount(src, weights=weight, minlength=len(labels))
+    degree += np.bincount(dst, weights=weight, minlength=len(labels))
+    sizes = 2.0 + 8.0 * np.sqrt(degree / max(degree.max(), 1e-12))
+
+    with open(html_dir, "w") as file:
+        file.write(html_template.format(title=html.escape(title)))
+        file.write('{"nodes": {"label": ')
+        json.dump(list(labels), file)
+        file.write(', "x": ')
+        json.dump(np.round(pos[:, 0], 5).tolist(), file)
+        file.write(', "y": ')
+        json.dump(np.round(pos[:, 1], 5).tolist(), file)
+        file.write(', "size": ')
+        json.dump(np.round(sizes, 2).tolist(), file)
+        file.write(', "color": ')
+        json.dump(list(colors), file)
+        file.write('}, "edges": {"source": ')
+        json.dump(np.asarray(src).tolist(), file)
+        file.write(', "target": ')
+        json.dump(np.asarray(dst).tolist(), file)
+        file.write(', "size": ')
+        json.dump(np.round(0.5 + 2.5 * np.asarray(weight), 2).tolist(), file)
+        file.write("}}")
+        file.write(html_footer)
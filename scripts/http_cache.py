@@ -0,0 +1,170 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+
+class ResponseCache:
+    """It defines an on-disk cache of STRING and UniProt API responses.
+
+    * Each response is keyed by endpoint url and normalized request
+    parameters, so that the same genes in another order hit the same entry.
+    * Entries older than ttl seconds are fetched again. If max_bytes is
+    given, least recently used entries are evicted beyond it.
+    * In offline mode, responses are served only from the cache (expired
+    ones included), and a missing entry raises ValueError instead of
+    sending a request."""
+
+    # parameters that do not change the response
+    ignored_params = {"caller_identity"}
+
+    def __init__(
+            self,
+            db_dir: str,
+            ttl: Optional[float] = 7 * 24 * 3600,
+            max_bytes: Optional[int] = None,
+            offline: bool = False,
+            timeout: float = 60.0,
+    ) -> None:
+
+        """
+        Args:
+          - db_dir: the directory of sqlite file of the cache
+          - ttl: seconds after which an entry is expired, None for never
+          - max_bytes: the upper bound of total response bytes in the cache
+          - offline: if True, no request is sent to remote APIs
+          - timeout: seconds to wait for the lock of another writer"""
+
+        self.db_dir = db_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+
+        # one connection is shared by the threads of concurrent fetchers
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_dir, timeout=timeout, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " url TEXT NOT NULL,"
+                " body TEXT NOT NULL,"
+                " nbytes INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_access ON responses(last_access)")
+
+    @staticmethod
+    def normalize_params(params: dict) -> dict:
+        """It brings request parameters into a canonical form.
+
+        * STRING identifiers joined by "%0d" (or carriage returns) and list
+        values are sorted, other values are compared as strings."""
+
+        normalized = {}
+        for name, value in params.items():
+            if name in ResponseCache.ignored_params:
+                continue
+            if name == "identifiers" and isinstance(value, str):
+                value = value.replace("%0d", "\r").replace("\n", "\r").split("\r")
+            if isinstance(value, (list, tuple, set)):
+                value = sorted(str(v) for v in value if str(v) != "")
+            else:
+                value = str(value)
+            normalized[name] = value
+        return normalized
+
+    @staticmethod
+    def make_key(url: str, params: dict) -> str:
+        normalized = ResponseCache.normalize_params(params)
+        payload = json.dumps([url, normalized], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, url: str, params: dict) -> Optional[str]:
+        """It returns a cached response body, None if it is missing or expired."""
+
+        key = ResponseCache.make_key(url, params)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            body, created = row
+            now = time.time()
+            if not self.offline and self.ttl is not None and now - created > self.ttl:
+                return None
+
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        return body
+
+    def put(self, url: str, params: dict, body: str) -> None:
+        key = ResponseCache.make_key(url, params)
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, url, body, len(body.encode()), now, now),
+                )
+            self._evict()
+
+    def fetch(self, url: str, params: dict, request_fn: Callable[[], str]) -> str:
+        """It returns the response body from the cache or from request_fn.
+
+        Args:
+          - url: the endpoint url of the request
+          - params: the parameters of the request
+          - request_fn: a function sending the request and returning its body"""
+
+        body = self.get(url, params)
+        if body is not None:
+            return body
+
+        if self.offline:
+            raise ValueError(f"Response of {url} is not cached (offline mode)")
+
+        body = request_fn()
+        self.put(url, params, body)
+        return body
+
+    def _evict(self) -> None:
+        """It deletes expired entries and least recently used ones beyond max_bytes."""
+
+        with self.conn:
+            if self.ttl is not None and not self.offline:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+
+            if self.max_bytes is None:
+                return
+
+            total = self.conn.execute(
+                "SELECT COALESCE(SUM(nbytes), 0) FROM responses").fetchone()[0]
+            excess = total - self.max_bytes
+            if excess <= 0:
+                return
+
+            victims = []
+            rows = self.conn.execute(
+                "SELECT key, nbytes FROM responses ORDER BY last_access ASC").fetchall()
+            for key, nbytes in rows:
+                if excess <= 0:
+                    break
+                victims.append((key,))
+                excess -= nbytes
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
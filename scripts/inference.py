@@ -0,0 +1,115 @@
+import contextlib
+import time
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import torch
+
+
+precisions = ("fp32", "bf16", "int8")
+
+
+def prepare_model(
+        model: torch.nn.Module,
+        device: str,
+        precision: str = "fp32",
+        compile_model: bool = False,
+) -> torch.nn.Module:
+
+    """ It prepares a model for inference in a chosen precision.
+
+    * "fp32": weights in float32 on cpu, as the embedders always did.
+    * "bf16": weights in bfloat16, which halves their memory; forward
+    passes run under autocast (see autocast_context).
+    * "int8": linear layers are dynamically quantized to int8 weights,
+    activations are quantized on the fly. It is cpu only.
+    * compile_model: the model is compiled with torch.compile, which
+    pays off after its first few batches.
+
+    Args:
+      - model: a model already moved to device
+      - device: the device of model ("cpu" or "cuda")
+      - precision: one of "fp32", "bf16" and "int8"
+      - compile_model: if True, the model is compiled"""
+
+    if precision not in precisions:
+        raise ValueError(f"Precision should be one of {precisions}")
+
+    model.eval()
+    if precision == "bf16":
+        model.to(torch.bfloat16)
+    elif device == "cpu":
+        model.to(torch.float32)
+
+    if precision == "int8":
+        if device != "cpu":
+            raise ValueError("Int8 dynamic quantization is supported only on cpu")
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if compile_model:
+        model = torch.compile(model)
+    return model
+
+
+def autocast_context(device: str, precision: str):
+    """It returns an autocast context for bf16 forward passes."""
+
+    if precision == "bf16":
+        device_type = "cuda" if device.startswith("cuda") else "cpu"
+        return torch.autocast(device_type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def cosine_deviation(embeds: torch.Tensor, reference: torch.Tensor) -> np.ndarray:
+    """It returns 1 - cosine similarity of each embedding to its reference."""
+
+    cos = torch.nn.functional.cosine_similarity(embeds.float(), reference.float(), dim=1)
+    return (1.0 - cos).numpy()
+
+
+def compare_precisions(
+        make_embedder: Callable,
+        prot_seqs: list[str],
+        precisions_to_check: tuple = precisions,
+        compile_model: bool = False,
+) -> pd.DataFrame:
+
+    """ It checks speed and accuracy of precisions against fp32 reference.
+
+    * Every precision embeds the same sequences; cosine deviations of its
+    pooled embeddings from fp32 embeddings are reported with throughput,
+    so that the fastest precision within tolerance can be chosen.
+    * Models are created one at a time, and dropped after use. Embedders
+    should be created without a cache, so that every run reaches the model.
+
+    Args:
+      - make_embedder: a function creating an embedder from precision and
+      compile_model keywords, e.g. partial(ProtTransEmbedder, "cpu")
+      - prot_seqs: the amino acid sequences of proteins
+      - precisions_to_check: the precisions compared with fp32
+      - compile_model: if True, non-reference models are compiled
+
+    Returns: a DataFrame of precision, seqs_per_sec, mean and max
+    cosine deviation"""
+
+    def run(precision: str, compiled: bool) -> tuple:
+        embedder = make_embedder(precision=precision, compile_model=compiled)
+        start = time.perf_counter()
+        embeds = embedder.embed(prot_seqs, ["mean"])["mean"]
+        seconds = time.perf_counter() - start
+        return embeds, len(prot_seqs) / seconds
+
+    reference, reference_speed = run("fp32", False)
+    records = [("fp32", reference_speed, 0.0, 0.0)]
+
+    for precision in precisions_to_check:
+        if precision == "fp32" and not compile_model:
+            continue
+        embeds, speed = run(precision, compile_model)
+        deviation = cosine_deviation(embeds, reference)
+        label = f"{precision}+compile" if compile_model else precision
+        records.append((label, speed, float(deviation.mean()), float(deviation.max())))
+
+    return pd.DataFrame(records, columns=["precision", "seqs_per_sec", "mean_deviation", "max_deviation"])
+
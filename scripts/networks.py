@@ -1,36 +1,144 @@
+import json
 import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
 import networkx as nx
 import matplotlib.pyplot as plt
 from d3graph import d3graph, vec2adjmat
 
+import graph_analytics as ga
+from graph_layout import cached_force_layout, write_webgl_html
+
+
+merge_rules = ("max", "mean", "first")
+combine_policies = ("max", "first", "last", "sum", "noisy_or")
+
+
+def merge_edges(
+        src: np.ndarray,
+        dst: np.ndarray,
+        weight: np.ndarray,
+        rule: str = "max",
+        counts: Optional[np.ndarray] = None,
+        return_counts: bool = False,
+) -> tuple:
+
+    """ It merges duplicate edges given as arrays.
+
+    * Node id pairs are packed into int64 keys and sorted once. Weights of
+    duplicate keys are then reduced in one vectorized step.
+    * An edge may already be the mean of several observations; "mean"
+    rule weights edges by their counts, so that merging merged edges
+    again still gives the mean of all observations.
+
+    Args:
+      - src: smaller node ids of edges
+      - dst: larger node ids of edges
+      - weight: connectivity scores of edges
+      - rule: "max", "mean" or "first" (the earliest added) weight is kept
+      - counts: the number of observations behind each edge, 1 by default
+      - return_counts: if True, observation counts of unique edges are
+      returned as a fourth array
+
+    Returns: (src, dst, weight) arrays of unique edges sorted by node ids"""
+
+    if rule not in merge_rules:
+        raise ValueError(f"Merge rule should be one of {merge_rules}")
+
+    if counts is None:
+        counts = np.ones(len(src), dtype=np.int32)
+
+    if len(src) == 0:
+        result = (src.astype(np.int32), dst.astype(np.int32), weight.astype(np.float32))
+        return result + (counts.astype(np.int32),) if return_counts else result
+
+    keys = (src.astype(np.int64) << 32) | dst.astype(np.int64)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    sorted_weight = weight[order]
+    sorted_counts = counts[order].astype(np.int64)
+
+    is_start = np.ones(len(keys), dtype=bool)
+    is_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    starts = np.flatnonzero(is_start)
+
+    if rule == "first":
+        merged = sorted_weight[starts]
+    elif rule == "max":
+        merged = np.maximum.reduceat(sorted_weight, starts)
+    else:
+        sums = np.add.reduceat(sorted_weight * sorted_counts.astype(np.float64), starts)
+        merged = sums / np.add.reduceat(sorted_counts, starts)
+
+    unique_keys = sorted_keys[starts]
+    result = ((unique_keys >> 32).astype(np.int32),
+              (unique_keys & 0xFFFFFFFF).astype(np.int32),
+              merged.astype(np.float32))
+    if return_counts:
+        return result + (np.add.reduceat(sorted_counts, starts).astype(np.int32),)
+    return result
+
 
 class PPI:
-    def __init__(self) -> None:
+    def __init__(self, merge: str = "max") -> None:
+        """
+        Args:
+          - merge: the rule to combine weights of duplicate edges,
+          "max", "mean" or "first" """
+
+        if merge not in merge_rules:
+            raise ValueError(f"Merge rule should be one of {merge_rules}")
+        self.merge_rule = merge
 
         # Data structures to allocate PPI graph are defined.
         self.node_to_id: dict[str, int] = {}
-        self.id_to_node: dict[int, str] = {}
-        self.node_edges: set[tuple] = set()
-        self.id_edges: set[tuple] = set()
+        self.id_to_node: list[str] = []
         self.count = 0
 
+        # Edges are collected in COO buffers while the graph is built:
+        # int32 node ids (smaller id first) and float32 weights.
+        self._src = np.empty(1024, dtype=np.int32)
+        self._dst = np.empty(1024, dtype=np.int32)
+        self._weight = np.empty(1024, dtype=np.float32)
+        self._n_coo = 0
+
+        # observations merged into each edge, so that "mean" rule stays the
+        # mean of all added weights however often duplicates are merged
+        self._n_obs = np.empty(1024, dtype=np.int32)
+
+        # COO buffers are free of duplicates after freezing or merging;
+        # merge() then keeps a hash index of packed id pairs -> positions.
+        self._coo_unique = True
+        self._edge_index: Optional[dict[int, int]] = None
+
+        # CSR arrays are built from COO buffers on first query, and
+        # dropped whenever a new edge is added.
+        self._csr: Optional[tuple] = None
+
     def add_nodes(self, nodes: list[str]) -> None:
         """ It adds the nodes to two dictionaries.
         * Each node refers to a protein.
         * These proteins are represented by names and id numbers.
-        * Protein nodes are stored in "name to id" and "id to name" dicts. """
+        * Protein nodes are stored in "name to id" dict and "id to name" list. """
 
+        count = self.count
         for node in nodes:
             if node not in self.node_to_id:
                 self.node_to_id[node] = self.count
-                self.id_to_node[self.count] = node
+                self.id_to_node.append(node)
                 self.count += 1
 
+        # CSR arrays have one row per node
+        if self.count != count:
+            self._csr = None
+
     def add_edge(self, node1: str, node2: str, weight: float) -> None:
-        """ It adds the edge to two sets.
-        * Each edge is represented by a triplet of two nodes and weight.
-        * Two node names and indices are aggregated with edge weight to
-        contruct a triplet. These triplets are added to two different sets. 
+        """ It adds the edge to COO buffers.
+        * Each edge is represented by a triplet of two node ids and weight.
+        * Edges are undirected, the smaller node id is stored first.
 
         Args:
           - node1: the name of node 1
@@ -40,18 +148,577 @@ class PPI:
         if node1 not in self.node_to_id or node2 not in self.node_to_id:
             raise ValueError("The nodes of that edge are not in the graph")
 
-        edge = tuple(sorted((node1, node2)) + [weight])
-        self.node_edges.add(edge)
-
-        id1 = self.node_to_id[edge[0]]
-        id2 = self.node_to_id[edge[1]]
-        self.id_edges.add((id1, id2, weight))
+        id1 = self.node_to_id[node1]
+        id2 = self.node_to_id[node2]
+        self.add_edge_arrays(np.array([id1]), np.array([id2]), np.array([weight]))
 
     def add_edges(self, edges: list) -> None:
-        """ It adds the edges to two sets()."""
-        for edge in edges:
-            n1, n2, score = edge
-            self.add_edge(n1, n2, score)
+        """ It adds a list of (node1, node2, weight) triplets to COO buffers."""
+
+        if len(edges) == 0:
+            return
+
+        names1, names2, weights = zip(*edges)
+        self.add_edge_columns(names1, names2, weights, add_missing_nodes=False)
+
+    def add_edge_columns(
+            self,
+            names1,
+            names2,
+            weights,
+            add_missing_nodes: bool = True,
+    ) -> None:
+
+        """ It adds edges given as columns of node names and weights.
+
+        * Node names of both columns are factorized in one pass, so that
+        only distinct names go through the "name to id" dict. New names
+        are added as nodes unless add_missing_nodes is False.
+        * With "max" and "first" merge rules, duplicate edges of the batch
+        are merged before they reach COO buffers.
+
+        Args:
+          - names1: node names of first ends (list, array or Series)
+          - names2: node names of second ends
+          - weights: connectivity scores of edges
+          - add_missing_nodes: if False, unknown node names raise ValueError"""
+
+        names1 = np.asarray(names1, dtype=object)
+        names2 = np.asarray(names2, dtype=object)
+        weights = np.asarray(weights, dtype=np.float32)
+
+        if not (len(names1) == len(names2) == len(weights)):
+            raise ValueError("Edge columns should have the same length")
+        if len(names1) == 0:
+            return
+
+        codes, uniques = pd.factorize(np.concatenate([names1, names2]))
+
+        if add_missing_nodes:
+            self.add_nodes(uniques)
+        elif any(name not in self.node_to_id for name in uniques):
+            raise ValueError("The nodes of that edge are not in the graph")
+
+        lookup = np.fromiter((self.node_to_id[name] for name in uniques), np.int64, len(uniques))
+        ids = lookup[codes]
+        ids1, ids2 = ids[:len(names1)], ids[len(names1):]
+
+        counts = None
+        if self.merge_rule != "mean":
+            ids1, ids2, weights, counts = merge_edges(
+                np.minimum(ids1, ids2), np.maximum(ids1, ids2), weights, self.merge_rule,
+                return_counts=True)
+
+        self.add_edge_arrays(ids1, ids2, weights, counts)
+
+    def add_edge_frame(
+            self,
+            frame: pd.DataFrame,
+            columns: tuple = ("node1", "node2", "score"),
+            add_missing_nodes: bool = True,
+    ) -> None:
+
+        """ It adds edges from a DataFrame of node names and weights.
+
+        Args:
+          - frame: a DataFrame of edges, e.g. a parsed protein.links file
+          - columns: the names of node1, node2 and weight columns
+          - add_missing_nodes: if False, unknown node names raise ValueError"""
+
+        name1, name2, weight = columns
+        self.add_edge_columns(
+            frame[name1].to_numpy(), frame[name2].to_numpy(),
+            frame[weight].to_numpy(), add_missing_nodes)
+
+    def add_edge_arrays(
+            self,
+            ids1: np.ndarray,
+            ids2: np.ndarray,
+            weights: np.ndarray,
+            counts: Optional[np.ndarray] = None,
+    ) -> None:
+
+        """ It adds edges given as arrays of node ids and weights in bulk.
+
+        Args:
+          - ids1: node ids of first ends
+          - ids2: node ids of second ends
+          - weights: connectivity scores of edges
+          - counts: observations behind each edge, 1 by default"""
+
+        ids1 = np.asarray(ids1)
+        ids2 = np.asarray(ids2)
+        weights = np.asarray(weights, dtype=np.float32)
+
+        if not (len(ids1) == len(ids2) == len(weights)):
+            raise ValueError("Edge arrays should have the same length")
+        if len(ids1) == 0:
+            return
+        if min(ids1.min(), ids2.min()) < 0 or max(ids1.max(), ids2.max()) >= self.count:
+            raise ValueError("The nodes of that edge are not in the graph")
+
+        self._reserve(len(ids1))
+        end = self._n_coo + len(ids1)
+        self._src[self._n_coo:end] = np.minimum(ids1, ids2)
+        self._dst[self._n_coo:end] = np.maximum(ids1, ids2)
+        self._weight[self._n_coo:end] = weights
+        self._n_obs[self._n_coo:end] = 1 if counts is None else counts
+        self._n_coo = end
+        self._csr = None
+        self._coo_unique = False
+        self._edge_index = None
+
+    def _reserve(self, n_new: int) -> None:
+        """It grows COO buffers geometrically to fit n_new more edges."""
+
+        needed = self._n_coo + n_new
+        if needed <= len(self._src):
+            return
+
+        capacity = max(needed, 2 * len(self._src))
+        for name in ("_src", "_dst", "_weight", "_n_obs"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._n_coo] = old[:self._n_coo]
+            setattr(self, name, new)
+
+    def freeze(self) -> None:
+        """It builds CSR arrays of the graph from COO buffers.
+
+        * Duplicate edges are merged by the merge rule of the graph.
+        * Each undirected edge is stored in both rows of CSR arrays, so
+        that the neighbors of any node are one contiguous slice."""
+
+        if self._csr is not None:
+            return
+
+        src, dst, weight = self._dedup_coo()
+
+        # both directions of edges, self loops only once
+        loops = src == dst
+        rows = np.concatenate([src, dst[~loops]])
+        cols = np.concatenate([dst, src[~loops]])
+        weights = np.concatenate([weight, weight[~loops]])
+
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(self.count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=self.count), out=indptr[1:])
+
+        self._csr = (indptr, cols[order].astype(np.int32), weights[order])
+
+    def _dedup_coo(self) -> tuple:
+        """It merges duplicate edges of COO buffers with the merge rule."""
+
+        n = self._n_coo
+        if self._coo_unique:
+            return self._src[:n], self._dst[:n], self._weight[:n]
+
+        self._ensure_writable()
+        src, dst, weight, counts = merge_edges(
+            self._src[:n], self._dst[:n], self._weight[:n], self.merge_rule,
+            self._n_obs[:n], return_counts=True)
+
+        n_unique = len(src)
+        self._src[:n_unique] = src
+        self._dst[:n_unique] = dst
+        self._weight[:n_unique] = weight
+        self._n_obs[:n_unique] = counts
+        self._n_coo = n_unique
+
+        # positions of edges have changed
+        self._coo_unique = True
+        self._edge_index = None
+
+        return self._src[:n_unique], self._dst[:n_unique], self._weight[:n_unique]
+
+    def merge(self, other: "PPI", policy: str = "max") -> None:
+        """ It merges another PPI graph into this graph in place.
+
+        * Node ids of the other graph are remapped in bulk, and its edges
+        are checked against existing edges through a hash index. Shared
+        edges get combined scores, the others are appended, so the cost is
+        linear in the edges of the other graph.
+
+        Args:
+          - other: the PPI graph to be merged
+          - policy: the rule to combine scores of shared edges [1]
+
+        [1] "max", "first" (keep existing), "last" (take new), "sum" or
+        "noisy_or" (1 - (1 - s1)(1 - s2), as STRING combines evidence)"""
+
+        self.add_nodes(other.id_to_node)
+        lookup = np.fromiter(
+            (self.node_to_id[name] for name in other.id_to_node), np.int64, other.count)
+
+        src, dst, weight = other.edge_arrays()
+        self._merge_id_arrays(lookup[src], lookup[dst], weight, policy)
+
+    def extend_from_stream(
+            self,
+            records,
+            policy: str = "max",
+            chunk_size: int = 100000,
+    ) -> None:
+
+        """ It merges a stream of (node1, node2, score) records in chunks.
+
+        * Records can come from utils.iter_network_edges or
+        utils.iter_links_file, so that a large network is merged without
+        materializing it. Each chunk is factorized and merged like merge().
+
+        Args:
+          - records: an iterable of (node1, node2, score) triplets
+          - policy: the rule to combine scores of shared edges
+          - chunk_size: the number of records merged at once"""
+
+        chunk: list[tuple] = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == chunk_size:
+                self._merge_records(chunk, policy)
+                chunk = []
+        if chunk:
+            self._merge_records(chunk, policy)
+
+    def _merge_records(self, records: list[tuple], policy: str) -> None:
+        names1, names2, weights = zip(*records)
+        codes, uniques = pd.factorize(np.concatenate([
+            np.asarray(names1, dtype=object), np.asarray(names2, dtype=object)]))
+
+        self.add_nodes(uniques)
+        lookup = np.fromiter((self.node_to_id[name] for name in uniques), np.int64, len(uniques))
+        ids = lookup[codes]
+        self._merge_id_arrays(
+            ids[:len(records)], ids[len(records):], np.asarray(weights, dtype=np.float32), policy)
+
+    def _merge_id_arrays(self, ids1: np.ndarray, ids2: np.ndarray, weights: np.ndarray, policy: str) -> None:
+        """ It merges edges given by node ids against existing edges.
+
+        * Duplicates inside one batch repeat the same evidence (e.g. A-B
+        and B-A lines of STRING), so they are merged by their max score
+        before being combined with existing edges by the policy."""
+
+        if policy not in combine_policies:
+            raise ValueError(f"Combine policy should be one of {combine_policies}")
+        if len(ids1) == 0:
+            return
+
+        src, dst, weights, counts = merge_edges(
+            np.minimum(ids1, ids2), np.maximum(ids1, ids2),
+            np.asarray(weights, dtype=np.float32), "first" if policy == "first" else "max",
+            return_counts=True)
+        keys = (src.astype(np.int64) << 32) | dst.astype(np.int64)
+
+        index = self._ensure_edge_index()
+        positions = np.fromiter((index.get(key, -1) for key in keys.tolist()), np.int64, len(keys))
+        shared = positions >= 0
+
+        # combining scores of shared edges
+        self._ensure_writable()
+        old = self._weight[positions[shared]]
+        new = weights[shared]
+        if policy == "max":
+            combined = np.maximum(old, new)
+        elif policy == "first":
+            combined = old
+        elif policy == "last":
+            combined = new
+        elif policy == "sum":
+            combined = old + new
+        else:
+            combined = 1.0 - (1.0 - old) * (1.0 - new)
+        self._weight[positions[shared]] = combined
+        self._n_obs[positions[shared]] += counts[shared]
+
+        # appending new edges and indexing them
+        fresh = ~shared
+        n_fresh = int(fresh.sum())
+        start = self._n_coo
+        self._reserve(n_fresh)
+        self._src[start:start + n_fresh] = src[fresh]
+        self._dst[start:start + n_fresh] = dst[fresh]
+        self._weight[start:start + n_fresh] = weights[fresh]
+        self._n_obs[start:start + n_fresh] = counts[fresh]
+        self._n_coo = start + n_fresh
+
+        index.update(zip(keys[fresh].tolist(), range(start, start + n_fresh)))
+        self._csr = None
+
+    def _ensure_edge_index(self) -> dict:
+        """It builds the hash index of edges once, after merging duplicates."""
+
+        if self._edge_index is None:
+            src, dst, _ = self._dedup_coo()
+            keys = (src.astype(np.int64) << 32) | dst.astype(np.int64)
+            self._edge_index = dict(zip(keys.tolist(), range(len(keys))))
+        return self._edge_index
+
+    def _ensure_writable(self) -> None:
+        """It copies memory-mapped (read-only) COO buffers into memory."""
+
+        for name in ("_src", "_dst", "_weight", "_n_obs"):
+            array = getattr(self, name)
+            if not array.flags.writeable or isinstance(array, np.memmap):
+                setattr(self, name, np.array(array))
+
+    def save(self, save_dir: str, compress: bool = False) -> None:
+        """It saves the graph in a compact binary format.
+
+        * Without compression, the graph is a directory of raw ".npy" edge
+        and CSR arrays with a node name table, which can be memory-mapped
+        by load(). With compression, it is one ".npz" file, which is
+        smaller but has to be decompressed into memory.
+
+        Args:
+          - save_dir: a directory, or a ".npz" file if compress is True
+          (the suffix is added when it is missing)
+          - compress: whether the arrays are zip-compressed"""
+
+        self.freeze()
+        src, dst, weight = self.edge_arrays()
+        indptr, indices, csr_weight = self._csr
+        arrays = {"src": src, "dst": dst, "weight": weight, "n_obs": self._n_obs[:self._n_coo],
+                  "indptr": indptr, "indices": indices, "csr_weight": csr_weight}
+        meta = {"format": 1, "merge": self.merge_rule, "count": self.count}
+
+        if compress:
+            # numpy appends the suffix anyway, load() looks for the same path
+            if not save_dir.endswith(".npz"):
+                save_dir = f"{save_dir}.npz"
+            names = np.array(self.id_to_node, dtype=str)
+            np.savez_compressed(save_dir, names=names, meta=np.array(json.dumps(meta)), **arrays)
+            return
+
+        # arrays may be memory-mapped from this very directory, so they are
+        # written to temporary files and renamed over the old ones
+        os.makedirs(save_dir, exist_ok=True)
+        for name, array in arrays.items():
+            array_dir = os.path.join(save_dir, f"{name}.npy")
+            tmp_dir = os.path.join(save_dir, f"{name}.{os.getpid()}.tmp.npy")
+            np.save(tmp_dir, array)
+            os.replace(tmp_dir, array_dir)
+        with open(os.path.join(save_dir, "names.txt"), "w") as file:
+            file.write("\n".join(self.id_to_node))
+        with open(os.path.join(save_dir, "meta.json"), "w") as file:
+            json.dump(meta, file)
+
+    @staticmethod
+    def load(load_dir: str, mmap: bool = True) -> "PPI":
+        """It loads a graph saved by PPI.save.
+
+        * Edge and CSR arrays of an uncompressed graph are memory-mapped
+        read-only, so opening is nearly free and worker processes share one
+        page-cached copy. Adding edges later copies them into memory.
+
+        Args:
+          - load_dir: the directory or ".npz" file of the graph, the
+          suffix of which can be omitted
+          - mmap: whether the arrays of a directory are memory-mapped"""
+
+        if not os.path.exists(load_dir) and os.path.isfile(f"{load_dir}.npz"):
+            load_dir = f"{load_dir}.npz"
+
+        if os.path.isfile(load_dir):
+            with np.load(load_dir) as archive:
+                meta = json.loads(str(archive["meta"]))
+                names = archive["names"].tolist()
+                arrays = {name: archive[name] for name in archive.files
+                          if name not in ("names", "meta")}
+        else:
+            with open(os.path.join(load_dir, "meta.json")) as file:
+                meta = json.load(file)
+            with open(os.path.join(load_dir, "names.txt")) as file:
+                text = file.read()
+                names = text.split("\n") if text else []
+            mode = "r" if mmap else None
+            arrays = {name: np.load(os.path.join(load_dir, f"{name}.npy"), mmap_mode=mode)
+                      for name in ("src", "dst", "weight", "n_obs", "indptr", "indices", "csr_weight")
+                      if os.path.exists(os.path.join(load_dir, f"{name}.npy"))}
+
+        if len(names) != meta["count"]:
+            raise ValueError("Node name table does not match the saved graph")
+
+        graph = PPI(meta["merge"])
+        graph.id_to_node = names
+        graph.node_to_id = {name: i for i, name in enumerate(names)}
+        graph.count = len(names)
+
+        graph._src, graph._dst, graph._weight = arrays["src"], arrays["dst"], arrays["weight"]
+
+        # graphs saved before observation counts count every edge once
+        graph._n_obs = arrays.get("n_obs", np.ones(len(arrays["src"]), dtype=np.int32))
+        graph._n_coo = len(arrays["src"])
+        graph._csr = (arrays["indptr"], arrays["indices"], arrays["csr_weight"])
+        return graph
+
+    def edge_arrays(self) -> tuple:
+        """It returns (ids1, ids2, weights) arrays of unique edges."""
+
+        self.freeze()
+        n = self._n_coo
+        return self._src[:n], self._dst[:n], self._weight[:n]
+
+    def neighbors(self, node: str) -> tuple:
+        """It returns neighbor ids and edge weights of a node.
+
+        Args:
+          - node: the name of node
+
+        Returns: two array views of CSR arrays, node ids and weights"""
+
+        if node not in self.node_to_id:
+            raise ValueError("The node is not in the graph")
+
+        self.freeze()
+        indptr, indices, weights = self._csr
+        node_id = self.node_to_id[node]
+        start, end = indptr[node_id], indptr[node_id + 1]
+        return indices[start:end], weights[start:end]
+
+    def to_scipy(self) -> sp.csr_matrix:
+        """It returns the weighted adjacency matrix of the graph."""
+
+        self.freeze()
+        indptr, indices, weights = self._csr
+        return sp.csr_matrix((weights, indices, indptr), shape=(self.count, self.count))
+
+    @property
+    def num_edges(self) -> int:
+        self.freeze()
+        return self._n_coo
+
+    def _node_ids(self, nodes: list[str]) -> np.ndarray:
+        missing = [node for node in nodes if node not in self.node_to_id]
+        if missing:
+            raise ValueError(f"The nodes are not in the graph: {missing[:5]}")
+        return np.array([self.node_to_id[node] for node in nodes], dtype=np.int64)
+
+    def _to_series(self, values: np.ndarray, name: str) -> pd.Series:
+        return pd.Series(values, index=self.id_to_node, name=name)
+
+    def degree(self, weighted: bool = True) -> pd.Series:
+        """It returns (weighted) degree of all nodes by protein names."""
+
+        if not weighted:
+            self.freeze()
+            return self._to_series(np.diff(self._csr[0]), "degree")
+        adjmat = self.to_scipy()
+        return self._to_series(np.asarray(adjmat.sum(axis=1)).ravel(), "weighted_degree")
+
+    def pagerank(
+            self,
+            seeds: Optional[list[str]] = None,
+            alpha: float = 0.85,
+            tol: float = 1e-8,
+            max_iter: int = 100,
+    ) -> pd.Series:
+
+        """It ranks nodes by PageRank over weighted edges.
+
+        * If seed proteins (e.g. drug targets) are given, random walks
+        restart only from them, and the result is personalized PageRank:
+        the proteins closest to the seeds get the highest ranks.
+
+        Args:
+          - seeds: the names of seed nodes, all nodes by default
+          - alpha: the probability of following an edge
+          - tol: L1 change of ranks to stop the iteration
+          - max_iter: the upper bound of iterations"""
+
+        personalization = None
+        if seeds is not None:
+            personalization = np.zeros(self.count)
+            personalization[self._node_ids(seeds)] = 1.0
+
+        ranks = ga.pagerank(self.to_scipy(), personalization, alpha, tol, max_iter)
+        return self._to_series(ranks, "pagerank")
+
+    def k_hop(self, seeds: list[str], k: int) -> pd.Series:
+        """It returns the nodes within k hops of seed nodes.
+
+        Args:
+          - seeds: the names of seed nodes
+          - k: the upper bound of hops
+
+        Returns: hop distances of reached nodes by protein names"""
+
+        hops = ga.k_hop(self.to_scipy(), self._node_ids(seeds), k)
+        reached = np.flatnonzero(hops >= 0)
+        return pd.Series(hops[reached], index=[self.id_to_node[i] for i in reached], name="hops")
+
+    def k_hop_subgraph(self, seeds: list[str], k: int) -> "PPI":
+        """It returns a new PPI graph induced by the k hop neighborhood of seeds."""
+
+        hops = ga.k_hop(self.to_scipy(), self._node_ids(seeds), k)
+        keep = hops >= 0
+
+        src, dst, weight = self.edge_arrays()
+        mask = keep[src] & keep[dst]
+
+        subgraph = PPI(self.merge_rule)
+        subgraph.add_nodes([self.id_to_node[i] for i in np.flatnonzero(keep)])
+        remap = np.full(self.count, -1, dtype=np.int64)
+        remap[keep] = np.arange(keep.sum())
+        counts = self._n_obs[:self._n_coo][mask]
+        subgraph.add_edge_arrays(remap[src[mask]], remap[dst[mask]], weight[mask], counts)
+        return subgraph
+
+    def shortest_path_lengths(
+            self,
+            sources: list[str],
+            cost: str = "hops",
+            min_only: bool = True,
+    ):
+
+        """It returns shortest path lengths from source nodes to all nodes.
+
+        Args:
+          - sources: the names of source nodes
+          - cost: "hops" to count edges, "-log" to sum -log(score) of edges
+          - min_only: if True, the distance to the nearest source is returned
+          as a Series; otherwise a DataFrame with one row per source
+
+        * Unreachable nodes have inf distance."""
+
+        dists, _ = ga.shortest_paths(self.to_scipy(), self._node_ids(sources), cost, min_only)
+        if min_only:
+            return self._to_series(dists, "distance")
+        return pd.DataFrame(dists, index=sources, columns=self.id_to_node)
+
+    def shortest_path(self, source: str, target: str, cost: str = "hops") -> list[str]:
+        """It returns the protein names on a shortest path between two nodes.
+
+        * An empty list is returned if the nodes are not connected."""
+
+        source_id, target_id = self._node_ids([source, target])
+        dists, preds = ga.shortest_paths(self.to_scipy(), [source_id], cost, min_only=True)
+        if np.isinf(dists[target_id]):
+            return []
+
+        path = [target_id]
+        while path[-1] != source_id:
+            path.append(preds[path[-1]])
+        return [self.id_to_node[i] for i in reversed(path)]
+
+    def betweenness(
+            self,
+            n_samples: Optional[int] = None,
+            n_jobs: int = 1,
+            seed: int = 0,
+    ) -> pd.Series:
+
+        """It estimates normalized betweenness centrality of nodes.
+
+        * Shortest paths are counted by hops from n_samples random source
+        nodes (all nodes by default), split across n_jobs processes.
+
+        Args:
+          - n_samples: the number of sampled source nodes
+          - n_jobs: the number of worker processes
+          - seed: random seed of source sampling"""
+
+        values = ga.sampled_betweenness(self.to_scipy(), n_samples, n_jobs, seed)
+        return self._to_series(values, "betweenness")
 
     def list_graph_nodes(self) -> None:
         """It prints all nodes by indices and protein names."""
@@ -61,17 +728,38 @@ class PPI:
     def build_nx_graph(self) -> nx.Graph:
         """It builds a networkx graph for visualization."""
         graph = nx.Graph()
-        for node1, node2, score in self.node_edges:
-            graph.add_edge(node1, node2, weight=score)
+        src, dst, weight = self.edge_arrays()
+        names = self.id_to_node
+        graph.add_weighted_edges_from(
+            (names[i], names[j], w) for i, j, w in zip(src.tolist(), dst.tolist(), weight.tolist()))
         return graph
 
-    def draw_nx_graph(self) -> None:
+    def layout(self, n_iter: int = 100, seed: int = 7, cache_dir: Optional[str] = None) -> np.ndarray:
+        """It computes node positions with a sparse force-directed layout.
+
+        * Repulsion is approximated on a grid, so that large graphs
+        (10k+ nodes) are laid out in seconds rather than hours.
+        * If cache_dir is given, the layout of the same graph and
+        parameters is computed once and loaded from disk afterwards.
+
+        Returns: positions of nodes by node ids in [N, 2] shape"""
+
+        src, dst, weight = self.edge_arrays()
+        return cached_force_layout(
+            self.id_to_node, src, dst, weight, cache_dir, n_iter=n_iter, seed=seed)
+
+    def draw_nx_graph(self, cache_dir: Optional[str] = None) -> None:
 
         """It draws a PPI graph.
-        * It builds a networkx graph, and visualize them by protein names. """
+        * It builds a networkx graph, and visualize them by protein names.
+        * Node positions come from the sparse force layout of the graph.
+
+        Args:
+          - cache_dir: the directory where the layout is cached"""
 
         graph = self.build_nx_graph()
-        pos = nx.spring_layout(graph, seed=7)
+        positions = self.layout(cache_dir=cache_dir)
+        pos = {node: positions[self.node_to_id[node]] for node in graph.nodes}
 
         nx.draw(graph, pos, with_labels=False, node_size=20)
         nx.draw_networkx_labels(
@@ -91,15 +779,16 @@ class PPI:
         Args:
           - name: the name of plot
           - color: the color of nodes, only hex codes
-          - save_dir: the directory where ppi plot will be saved."""
+          - save_dir: the directory where ppi plot will be saved.
+
+        * d3graph builds a dense adjacency matrix, use export_html for
+        graphs beyond a few hundred proteins."""
 
-        source, target = [], []
-        for node1, node2, _ in self.node_edges:
-            source.append(node1)
-            target.append(node2)
+        src, dst, weight = self.edge_arrays()
+        source = [self.id_to_node[i] for i in src.tolist()]
+        target = [self.id_to_node[i] for i in dst.tolist()]
 
-        weight = [1 for i in range(len(source))]
-        adjmat = vec2adjmat(source, target, weight=weight)
+        adjmat = vec2adjmat(source, target, weight=weight.tolist())
 
         colors = [color for _ in range(self.count)]
         file_name = f"{name} proteins"
@@ -108,3 +797,32 @@ class PPI:
         d3.graph(adjmat)
         d3.set_node_properties(color=colors)
         d3.show(filepath=os.path.join(save_dir, f"{file_name}.html"))
+
+    def export_html(
+            self,
+            name: str,
+            color: str,
+            save_dir: str,
+            cache_dir: Optional[str] = None,
+    ) -> None:
+
+        """It exports a PPI graph into a WebGL page for large graphs.
+
+        * Node positions come from the sparse force layout, and the graph
+        is written as JSON arrays of nodes and weight-scaled edges, which
+        are rendered by sigma.js in the browser.
+
+        Args:
+          - name: the name of plot
+          - color: the color of nodes, only hex codes
+          - save_dir: the directory where ppi plot will be saved.
+          - cache_dir: the directory where the layout is cached"""
+
+        src, dst, weight = self.edge_arrays()
+        positions = self.layout(cache_dir=cache_dir)
+        colors = [color for _ in range(self.count)]
+
+        file_name = f"{name} proteins"
+        write_webgl_html(
+            os.path.join(save_dir, f"{file_name}.html"), file_name,
+            self.id_to_node, positions, colors, src, dst, weight)
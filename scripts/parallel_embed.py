@@ -0,0 +1,235 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+import numpy as np
+import torch
+
+from embed_matrix import EmbeddingMatrix
+from embedder import ProtT5Embedder, ProtTransEmbedder
+from protein import ProteinDB
+
+
+embedder_names = ("prot_trans", "prot_t5")
+
+# model replica of a worker process, created once by _init_worker
+_worker_embedder = None
+
+
+def save_atomic(save_dir: str, array: np.ndarray) -> None:
+    """It saves an array into a temporary file and renames it into place."""
+    tmp_dir = f"{save_dir}.{os.getpid()}.tmp.npy"
+    np.save(tmp_dir, array)
+    os.replace(tmp_dir, save_dir)
+
+
+class ShardStore:
+    """It defines a resumable output store of sharded embeddings.
+
+    * Sequences are split into fixed shards of shard_size sequences, and
+    the embeddings of each shard are saved as "shard_<id>.npy". A shard
+    is first written to a temporary file and then renamed, so that a
+    crash never leaves a partial shard behind; unfinished shards are
+    simply computed again on the next run.
+    * A manifest keeps the hash of input sequences and run settings, so
+    that a store is never resumed with different inputs.
+    * The store directory can live on a shared filesystem, where hosts
+    fill disjoint subsets of shards (see host_shards)."""
+
+    def __init__(self, store_dir: str, prot_seqs: list[str], shard_size: int, settings: dict) -> None:
+        """
+        Args:
+          - store_dir: the directory of shard files
+          - prot_seqs: the amino acid sequences of proteins
+          - shard_size: the number of sequences in one shard
+          - settings: embedder name, pooling etc. recorded in the manifest"""
+
+        if shard_size <= 0:
+            raise ValueError("Shard size should be positive")
+
+        self.store_dir = store_dir
+        self.shard_size = shard_size
+        self.n_seqs = len(prot_seqs)
+        self.n_shards = (self.n_seqs + shard_size - 1) // shard_size
+
+        digest = hashlib.sha256()
+        for seq in prot_seqs:
+            digest.update(seq.encode())
+            digest.update(b"\n")
+
+        manifest = {"n_seqs": self.n_seqs, "shard_size": shard_size,
+                    "seqs_hash": digest.hexdigest(), **settings}
+
+        os.makedirs(store_dir, exist_ok=True)
+        manifest_dir = os.path.join(store_dir, "manifest.json")
+        if os.path.exists(manifest_dir):
+            with open(manifest_dir) as file:
+                if json.load(file) != manifest:
+                    raise ValueError(f"Store {store_dir} belongs to different sequences or settings")
+        else:
+            # hosts may race here, they write the same content
+            tmp_dir = f"{manifest_dir}.{os.getpid()}.tmp"
+            with open(tmp_dir, "w") as file:
+                json.dump(manifest, file)
+            os.replace(tmp_dir, manifest_dir)
+
+    def shard_dir(self, shard_id: int) -> str:
+        return os.path.join(self.store_dir, f"shard_{shard_id:06d}.npy")
+
+    def shard_slice(self, shard_id: int) -> slice:
+        return slice(shard_id * self.shard_size, min((shard_id + 1) * self.shard_size, self.n_seqs))
+
+    def is_done(self, shard_id: int) -> bool:
+        return os.path.exists(self.shard_dir(shard_id))
+
+    def host_shards(self, shard_index: int = 0, total_shards: int = 1) -> list[int]:
+        """It returns the shards of one host, every total_shards-th shard."""
+
+        if not 0 <= shard_index < total_shards:
+            raise ValueError("Shard index should be in [0, total_shards)")
+        return list(range(shard_index, self.n_shards, total_shards))
+
+    def pending(self, shard_ids: list[int]) -> list[int]:
+        return [shard_id for shard_id in shard_ids if not self.is_done(shard_id)]
+
+    def write(self, shard_id: int, embeds: np.ndarray) -> None:
+        save_atomic(self.shard_dir(shard_id), embeds)
+
+    def is_complete(self) -> bool:
+        return len(self.pending(list(range(self.n_shards)))) == 0
+
+    def collect(self) -> np.ndarray:
+        """It concatenates all shards in the order of input sequences."""
+
+        missing = self.pending(list(range(self.n_shards)))
+        if missing:
+            raise ValueError(f"{len(missing)} shards are not computed yet, e.g. {missing[:5]}")
+        return np.concatenate([np.load(self.shard_dir(i)) for i in range(self.n_shards)])
+
+
+def _init_worker(embedder_name: str, n_threads: int, embedder_kwargs: dict) -> None:
+    """It pins the thread count of a worker and loads its model replica."""
+
+    global _worker_embedder
+    torch.set_num_threads(n_threads)
+    torch.set_num_interop_threads(1)
+
+    if embedder_name == "prot_t5":
+        _worker_embedder = ProtT5Embedder(device="cpu", **embedder_kwargs)
+    else:
+        _worker_embedder = ProtTransEmbedder(device="cpu", **embedder_kwargs)
+
+
+def _embed_shard(shard_id: int, shard_dir: str, prot_seqs: list[str], pooling: str) -> int:
+    """It embeds one shard in a worker and saves it into the store."""
+
+    embeds = _worker_embedder.embed(prot_seqs, [pooling])[pooling]
+    save_atomic(shard_dir, embeds.numpy())
+    return shard_id
+
+
+def embed_parallel(
+        prot_seqs: list[str],
+        store_dir: str,
+        embedder_name: str = "prot_trans",
+        pooling: str = "mean",
+        n_workers: int = 4,
+        threads_per_worker: Optional[int] = None,
+        shard_size: int = 1000,
+        shard_index: int = 0,
+        total_shards: int = 1,
+        embedder_kwargs: Optional[dict] = None,
+) -> Optional[np.ndarray]:
+
+    """ It embeds sequences with data-parallel model replicas on CPU.
+
+    * Torch intra-op threading scales poorly over many cores, so instead
+    n_workers processes each load their own model and run with
+    threads_per_worker threads (all cores split evenly by default).
+    * Results go into a ShardStore. Finished shards are skipped, so an
+    interrupted run resumes by calling it again with the same arguments.
+    * Across hosts, each host runs with its own shard_index out of
+    total_shards against a store on a shared filesystem.
+    * Shards with the longest sequences are submitted first, so that no
+    long shard is left running alone at the end.
+
+    Args:
+      - prot_seqs: the amino acid sequences of proteins
+      - store_dir: the directory of shard files
+      - embedder_name: "prot_trans" or "prot_t5"
+      - pooling: "mean", "max" or "cls" (only for "prot_trans")
+      - n_workers: the number of worker processes on this host
+      - threads_per_worker: torch threads of each worker
+      - shard_size: the number of sequences in one shard
+      - shard_index, total_shards: the part of shards of this host
+      - embedder_kwargs: extra arguments of embedder, e.g. max_tokens
+
+    Returns: embeddings in the order of prot_seqs once every shard of
+    every host is done, otherwise None"""
+
+    if embedder_name not in embedder_names:
+        raise ValueError(f"Embedder name should be one of {embedder_names}")
+    if pooling not in ("mean", "cls", "max") or (embedder_name == "prot_t5" and pooling == "cls"):
+        raise ValueError("Pooling should be mean, max, or cls for prot_trans")
+
+    # everything that changes the embeddings is recorded in the manifest,
+    # e.g. a bf16 run never resumes a store begun in fp32
+    embedder_cls = ProtT5Embedder if embedder_name == "prot_t5" else ProtTransEmbedder
+    embedder_settings = {"precision": "fp32", "compile_model": False, "fast_tokenizer": True}
+    embedder_settings.update({key: value for key, value in (embedder_kwargs or {}).items()
+                              if isinstance(value, (str, int, float, bool, type(None)))})
+
+    store = ShardStore(store_dir, prot_seqs, shard_size,
+                       {"embedder": embedder_name, "ckpt_name": embedder_cls.checkpoint,
+                        "pooling": pooling, "embedder_kwargs": embedder_settings})
+    pending = store.pending(store.host_shards(shard_index, total_shards))
+
+    if pending:
+        def shard_length(shard_id: int) -> int:
+            return sum(len(seq) for seq in prot_seqs[store.shard_slice(shard_id)])
+        pending.sort(key=shard_length, reverse=True)
+
+        n_workers = max(1, min(n_workers, len(pending)))
+        n_threads = threads_per_worker or max(1, (os.cpu_count() or 1) // n_workers)
+
+        # spawned workers do not inherit torch thread pools of the parent
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(embedder_name, n_threads, embedder_kwargs or {}),
+        ) as executor:
+            futures = [executor.submit(_embed_shard, shard_id, store.shard_dir(shard_id),
+                                       prot_seqs[store.shard_slice(shard_id)], pooling)
+                       for shard_id in pending]
+            for done, future in enumerate(as_completed(futures), start=1):
+                shard_id = future.result()
+                print(f"Shard {shard_id} is done ({done}/{len(pending)})")
+
+    return store.collect() if store.is_complete() else None
+
+
+def embed_protein_db(
+        protein_db: ProteinDB,
+        store_dir: str,
+        matrix_dir: Optional[str] = None,
+        **kwargs,
+) -> Optional[np.ndarray]:
+
+    """ It embeds all sequences of a protein database in parallel.
+
+    * Arguments other than the database are those of embed_parallel.
+    * If matrix_dir is given, the finished embeddings are also written as
+    an EmbeddingMatrix with the genes and uniprot ids of the database."""
+
+    protein_db.load_sequences()
+    database = protein_db.database
+    embeds = embed_parallel(database["Sequence"].tolist(), store_dir, **kwargs)
+
+    if embeds is not None and matrix_dir is not None:
+        EmbeddingMatrix.write(matrix_dir, embeds, database["Gene"].tolist(), database.index.tolist())
+    return embeds
@@ -1,14 +1,25 @@
+import os
 from argparse import Namespace
+from typing import Optional
+
 import numpy as np
 import pandas as pd
 
-from sklearn.manifold import TSNE
-import plotly.express as px
+import plotly.graph_objects as go
+
+from pfam_index import PfamIndex
+from reduction import reduce_embeds
+from utils import ColorAllocator
 
 
 class Pfam:
 
-    def __init__(self, database_tsv_dir: str, gene_or_prot: str = "Gene") -> None:
+    def __init__(
+            self,
+            database_tsv_dir: str,
+            gene_or_prot: str = "Gene",
+            index_cache_dir: Optional[str] = None,
+    ) -> None:
         """ Defines protein family database.
         This database is maintained as a DataFrame of
             - protein ids
@@ -19,7 +30,9 @@ class Pfam:
           * database_tsv_dir: the directory of tsv file for pfam db entries.
           * gene_or_prot: a string of "Gene" or "ID" to choose database type:
             - gene-pfam
-            - protein-pfam """
+            - protein-pfam
+          * index_cache_dir: a ".npz" file to cache the pfam index; it is
+          rebuilt when the database file is newer or gene_or_prot differs """
 
         self.database = pd.read_csv(
             database_tsv_dir,
@@ -32,8 +45,48 @@ class Pfam:
         print(self.database)
 
         self.colors = Pfam.yield_color_codes()
-        self.gp_pfam, self.pfam_color = self.gp_to_pfam(gene_or_prot)
-        self.pfam_gp = Pfam.reverse_gp_pfam(self.gp_pfam)
+        self.index = self.build_index(database_tsv_dir, gene_or_prot, index_cache_dir)
+
+        # dict views of the index, built on first access
+        self._gp_pfam: Optional[dict] = None
+        self._pfam_color: Optional[dict] = None
+        self._pfam_gp: Optional[dict] = None
+
+    @property
+    def gp_pfam(self) -> dict:
+        """ A dict of gene/protein to its pfam key."""
+        if self._gp_pfam is None:
+            self._gp_pfam, self._pfam_color = self.gp_to_pfam()
+        return self._gp_pfam
+
+    @property
+    def pfam_color(self) -> dict:
+        """ A dict of pfam key to its rgb color, "null" is white."""
+        if self._pfam_color is None:
+            self._gp_pfam, self._pfam_color = self.gp_to_pfam()
+        return self._pfam_color
+
+    @property
+    def pfam_gp(self) -> dict:
+        """ A dict of pfam key to the list of its genes/proteins."""
+        if self._pfam_gp is None:
+            self._pfam_gp = {key: self.index.group(key).tolist() for key in self.index.keys.tolist()}
+        return self._pfam_gp
+
+    def build_index(self, database_tsv_dir: str, choice: str, index_cache_dir: Optional[str]) -> PfamIndex:
+        """ Builds the pfam index, or loads it from the cache file."""
+
+        # a cached index is reused only if it is built for the same column
+        if index_cache_dir is not None and os.path.exists(index_cache_dir):
+            if os.path.getmtime(index_cache_dir) >= os.path.getmtime(database_tsv_dir):
+                index = PfamIndex.load(index_cache_dir)
+                if index.column == choice:
+                    return index
+
+        index = PfamIndex.build(self.database[choice], self.database["Pfam"])
+        if index_cache_dir is not None:
+            index.save(index_cache_dir)
+        return index
 
     def detect_large_pfams(self, size: int = 30) -> list:
 
@@ -45,15 +98,30 @@ class Pfam:
         than the size given as input.
 
         Args:
-          * size: the size of pfam group as threshold"""
+          * size: the size of pfam group as threshold
+
+        * Group sizes are kept sorted in the pfam index, so that this is
+        a binary search. Groups are returned from the largest one, and
+        genes without pfam entries are not counted as a group."""
+
+        return self.index.groups_larger_than(size)
+
+    def genes_with_domain(self, domain: str) -> list:
+
+        """Returns genes/proteins having a single pfam domain.
+
+        * Unlike pfam groups, a gene/protein is counted in each of its
+        domains: ESYT2 (PF00168;PF17047) is returned both for PF00168
+        and for PF17047.
+
+        Args:
+          * domain: a single pfam id such as "PF00069" """
 
-        large_pfams = []
-        for pfam, gp_list in self.pfam_gp.items():
-            if len(gp_list) >= size:
-                large_pfams.append(pfam)
-        return large_pfams
+        if domain not in self.index.domain_codes:
+            return []
+        return self.index.domain(domain).tolist()
 
-    def gp_to_pfam(self, choice: str = "Gene") -> tuple:
+    def gp_to_pfam(self, choice: Optional[str] = None) -> tuple:
 
         """ Creates a dict of gp-pfam pairs.
         * Either gene names or protein names are used as keys
@@ -71,32 +139,23 @@ class Pfam:
         These gene names are generally separated by ; sign.
 
         https://www.ncbi.nlm.nih.gov/gene?Db=gene&Cmd=DetailsSearch&Term=503618
-        """
-
-        index = 0
-        white = np.array(3 * [255], dtype=np.uint8)
 
-        gene_pfam_dict = {}
-        pfam_color_dict = {"null": white}
+        Args:
+          * choice: "Gene" or "ID", the column of pfam index by default
+        """
 
-        gps = self.database[choice].values
-        pfams = self.database["Pfam"].values
+        if choice is not None and choice != self.index.column:
+            raise ValueError(f"Pfam index is built for {self.index.column}, not {choice}")
 
-        for gp, pfam in zip(gps, pfams):
-            if gp == "null":
-                continue
+        white = np.array(3 * [255], dtype=np.uint8)
 
-            # one gene can have multiple synonym names
-            pfam = Pfam.sort_pfam(pfam)
-            for synon in gp.split(" "):
-                if synon.endswith(";"):  # [1]
-                    gene_pfam_dict[synon[:-1]] = pfam
-                else:
-                    gene_pfam_dict[synon] = pfam
+        members = self.index.members.tolist()
+        member_keys = self.index.keys[self.index.member_codes].tolist()
+        gene_pfam_dict = dict(zip(members, member_keys))
 
-            if pfam not in pfam_color_dict:
-                pfam_color_dict[pfam] = self.colors[index]
-                index += 1
+        pfam_color_dict = {"null": white}
+        for index, pfam in enumerate(self.index.keys.tolist()):
+            pfam_color_dict[pfam] = self.colors[index]
 
         return gene_pfam_dict, pfam_color_dict
 
@@ -106,79 +165,158 @@ class Pfam:
             query_embeds: np.ndarray,
             config: Namespace,
             target_pfams: list = [],
+            cache_dir: Optional[str] = None,
     ) -> tuple:
 
-        colors: list[np.ndarray] = []
-        awhite = np.array(3 * [245], dtype=np.uint8)
+        """ Projects embeddings onto 2D and plots them by pfam colors.
 
-        # getting colors for query genes
-        # some query genes may not exist in Pfam database
-        for qgene in query_genes:
-            if qgene in self.gp_pfam:
-                pfam = self.gp_pfam[qgene]
-                color = self.pfam_color[pfam]
-                colors.append(color)
-            else:
-                colors.append(awhite)
+        * The projection backend is chosen by config (see
+        reduction.reduction_config): PCA pre-reduction followed by sklearn
+        or openTSNE TSNE, UMAP, or PCA alone.
+        * If cache_dir is given, coordinates are cached by embeddings and
+        config, so replotting other target pfams does not refit anything.
+
+        Args:
+          * query_genes: gene names of embedding rows
+          * query_embeds: embedding matrix in [N, D] shape
+          * config: projection config
+          * target_pfams: pfam keys plotted in the second figure
+          * cache_dir: the directory of cached coordinates"""
 
         # embeddings of query genes are projected onto 2/3D coords
         print("Fitting TSNE ...")
-        tsne = TSNE(n_components=config.n_components,
-                    perplexity=config.perplexity,
-                    init=config.init,
-                    learning_rate=config.learning_rate)
-        tsne_embeds = tsne.fit_transform(X=query_embeds).T
-
-        # creating a dict of query genes across tsne coords and colors
-        xs, ys = tsne_embeds[0], tsne_embeds[1]
-        tsne_dict = {g: (x, y) for g, x, y in zip(query_genes, xs, ys)}
+        projection = self.project(query_genes, query_embeds, config, cache_dir)
 
         # visualizing entire pfam scatter plot
         print("Visualizing entire pfam scatter")
-        hex_colors = Pfam.rgb_to_hex(np.array(colors))
-        df1 = pd.DataFrame({"x": xs, "y": ys})
-        fig = px.scatter(df1, x="x", y="y")
-
-        fig.update_traces(marker=dict(size=4, symbol="circle", color=hex_colors))
-        fig.update_xaxes(range=[-120, 120], dtick=20)
-        fig.update_yaxes(range=[-120, 120], dtick=20)
-        fig.show()
+        self.plot_projection(projection).show()
 
         # visualizing some part of pfam scatter plot
         print("Visualizing some part of pfam scatter")
-        filt_xs, filt_ys, filt_legends = [], [], []
         for tpfam in target_pfams:
-            if tpfam in self.pfam_gp:
+            if tpfam not in self.index.key_codes:
+                print("Given target pfam does not exist")
 
-                tgene = self.pfam_gp[tpfam]  # a pfam: gene or genes
-                txyl = [(*tsne_dict[g], self.gp_pfam[g])
-                        for g in tgene if g in tsne_dict]
-                txs, tys, tlegends = map(list, zip(*txyl))
+        mask = self.pfam_mask(projection, target_pfams)
+        self.plot_projection(projection, mask=mask, legend=True).show()
 
-                filt_xs.extend(txs)
-                filt_ys.extend(tys)
-                filt_legends.extend(tlegends)
-            else:
-                print("Given target pfam does not exist")
+        df1 = projection[["x", "y"]]
+        df2 = projection.loc[mask, ["x", "y", "pfam"]].rename(columns={"pfam": "family"})
+        return df1, df2
+
+    def project(
+            self,
+            query_genes: list,
+            query_embeds: np.ndarray,
+            config: Namespace,
+            cache_dir: Optional[str] = None,
+    ) -> pd.DataFrame:
 
-        color_map = {legend: Pfam.rgb_to_hex(self.pfam_color[legend])[0]
-                     for legend in filt_legends}
+        """ Projects embeddings and annotates them with pfam groups.
 
-        df2 = pd.DataFrame({
-            "x": filt_xs,
-            "y": filt_ys,
-            "family": filt_legends}
-        )
+        * The result is columnar: one row per query gene with its
+        coordinates (x, y and z for 3D), pfam key and color index. Color
+        index is the group code in pfam index, and -1 for genes which are
+        not in Pfam database.
 
-        fig = px.scatter(df2, x="x", y="y", color="family",
-                         color_discrete_map=color_map)
+        Args:
+          * query_genes: gene names of embedding rows
+          * query_embeds: embedding matrix in [N, D] shape
+          * config: projection config, see reduction.reduction_config
+          * cache_dir: the directory of cached coordinates"""
 
-        fig.update_traces(marker=dict(size=4, symbol="circle"))
-        fig.update_xaxes(range=[-120, 120], dtick=20)
-        fig.update_yaxes(range=[-120, 120], dtick=20)
-        fig.show()
+        coords = reduce_embeds(query_embeds, config, cache_dir)
 
-        return df1, df2
+        rows = pd.Index(self.index.members).get_indexer(query_genes)
+        codes = np.where(rows >= 0, self.index.member_codes[rows], -1).astype(np.int32)
+        keys = np.where(codes >= 0, self.index.keys[codes], "")
+
+        projection = pd.DataFrame({"gene": query_genes})
+        for axis, name in zip(range(coords.shape[1]), ("x", "y", "z")):
+            projection[name] = coords[:, axis]
+        projection["pfam"] = keys
+        projection["color_index"] = codes
+        return projection
+
+    def pfam_mask(self, projection: pd.DataFrame, target_pfams: list) -> np.ndarray:
+        """ Returns a boolean mask of projection rows in target pfam groups."""
+
+        codes = [self.index.key_codes[key] for key in target_pfams if key in self.index.key_codes]
+        return np.isin(projection["color_index"].to_numpy(), codes)
+
+    def plot_projection(
+            self,
+            projection: pd.DataFrame,
+            mask: Optional[np.ndarray] = None,
+            legend: bool = False,
+            bins: Optional[int] = 1000,
+            marker_size: int = 4,
+    ) -> go.Figure:
+
+        """ Renders a projection as a WebGL scatter plot.
+
+        * Points are drawn with Scattergl, which stays responsive with
+        tens of thousands of points.
+        * If bins is given, points are aggregated datashader-style: only one
+        point per (bins x bins) screen cell and color is kept, which does
+        not change the picture but bounds the number of drawn points.
+        * Axis ranges follow the data.
+
+        Args:
+          * projection: the result of Pfam.project
+          * mask: a boolean mask of rows to be plotted, all rows by default
+          * legend: if True, each pfam group is a separate legend entry
+          * bins: the resolution of aggregation, None to draw every point
+          * marker_size: the size of points"""
+
+        if mask is not None:
+            projection = projection[mask]
+
+        codes = projection["color_index"].to_numpy()
+        xs = projection["x"].to_numpy()
+        ys = projection["y"].to_numpy()
+
+        if bins is not None and len(projection) > 0:
+            keep = Pfam.aggregate_points(xs, ys, codes, bins)
+            projection, xs, ys, codes = projection.iloc[keep], xs[keep], ys[keep], codes[keep]
+
+        # genes which are not in Pfam database are almost white
+        rgb = np.full((len(codes), 3), 245, dtype=np.uint8)
+        known = codes >= 0
+        rgb[known] = self.colors[codes[known]]
+        hex_colors = np.array(Pfam.rgb_to_hex(rgb), dtype=object)
+
+        fig = go.Figure()
+        marker = dict(size=marker_size, symbol="circle")
+
+        if legend:
+            for code in np.unique(codes):
+                group = codes == code
+                fig.add_trace(go.Scattergl(
+                    x=xs[group], y=ys[group], mode="markers",
+                    name=projection["pfam"].iloc[np.flatnonzero(group)[0]] or "null",
+                    text=projection["gene"].to_numpy()[group],
+                    marker=dict(marker, color=hex_colors[group][0])))
+        else:
+            fig.add_trace(go.Scattergl(
+                x=xs, y=ys, mode="markers", text=projection["gene"].to_numpy(),
+                marker=dict(marker, color=hex_colors), showlegend=False))
+
+        fig.update_layout(xaxis_title="x", yaxis_title="y")
+        return fig
+
+    @staticmethod
+    def aggregate_points(xs: np.ndarray, ys: np.ndarray, codes: np.ndarray, bins: int) -> np.ndarray:
+        """ Returns indices of one point per grid cell and color index."""
+
+        def to_bins(values: np.ndarray) -> np.ndarray:
+            low, high = values.min(), values.max()
+            scaled = (values - low) / max(high - low, 1e-12) * (bins - 1)
+            return scaled.astype(np.int64)
+
+        cells = (to_bins(xs) * bins + to_bins(ys)) * (codes.max() + 2) + (codes + 1)
+        _, keep = np.unique(cells, return_index=True)
+        return np.sort(keep)
 
     @staticmethod
     def rgb_to_hex(rgb_colors: np.ndarray) -> list:
@@ -190,18 +328,21 @@ class Pfam:
         if len(rgb_colors.shape) == 1:
             rgb_colors = np.array([rgb_colors])
 
-        hex_colors = []
-        for r, g, b in rgb_colors:
-            hex = "#" + ('{:02X}' * 3).format(r, g, b)
-            hex_colors.append(hex)
-        return hex_colors
+        # a lookup table of two-digit hex codes maps all channels at once
+        rgb_colors = np.asarray(rgb_colors, dtype=np.uint8)
+        hex_table = np.array([f"{i:02X}" for i in range(256)], dtype=object)
+        hex_colors = "#" + hex_table[rgb_colors[:, 0]] + hex_table[rgb_colors[:, 1]] \
+            + hex_table[rgb_colors[:, 2]]
+        return hex_colors.tolist()
 
     @staticmethod
-    def yield_color_codes(max_val: int = 235) -> np.ndarray:
-        colors = np.indices(3 * [max_val], dtype=np.uint8)
-        colors = colors.reshape(3, -1).T[1:]
-        np.random.shuffle(colors)
-        return colors
+    def yield_color_codes(max_val: int = 235) -> ColorAllocator:
+        """ Returns a lazy allocator of distinct pfam colors.
+
+        * Channel values stay below max_val to keep colors away from
+        white, which denotes genes without pfam entries, and black is
+        skipped."""
+        return ColorAllocator(max_val, skip_black=True)
 
     @staticmethod
     def sort_pfam(pfams: str) -> str:
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+
+class PfamIndex:
+    """It defines a precomputed index between genes/proteins and pfams.
+
+    * Each gene/protein (gp) has a pfam key, its sorted pfam entries
+    joined by ";" (e.g. "PF00168;PF17047"), as in Pfam.sort_pfam. Genes
+    without pfam entries have the empty key "".
+    * Keys are factorized into integer group codes, and group members are
+    kept CSR-style: members of group g are members[indptr[g]:indptr[g+1]].
+    * Group sizes are kept sorted, so that groups larger than a size are
+    found by binary search.
+    * Each gp also belongs to every single pfam domain of its key, which
+    is kept in a second CSR mapping (domain -> members).
+    * column is the database column gps come from ("Gene" or "ID"), so
+    that a cached index is not reused for the other column."""
+
+    def __init__(
+            self,
+            members: np.ndarray,
+            keys: np.ndarray,
+            indptr: np.ndarray,
+            member_codes: np.ndarray,
+            domains: np.ndarray,
+            domain_indptr: np.ndarray,
+            domain_members: np.ndarray,
+            column: str = "",
+    ) -> None:
+
+        self.column = column
+        self.members = members
+        self.keys = keys
+        self.indptr = indptr
+        self.member_codes = member_codes
+        self.domains = domains
+        self.domain_indptr = domain_indptr
+        self.domain_members = domain_members
+
+        self.key_codes = {key: code for code, key in enumerate(keys.tolist())}
+        self.domain_codes = {domain: code for code, domain in enumerate(domains.tolist())}
+        self.member_rows = {member: row for row, member in enumerate(members.tolist())}
+
+        # group sizes in ascending order, empty key excluded
+        sizes = np.diff(indptr)
+        if "" in self.key_codes:
+            sizes = sizes.copy()
+            sizes[self.key_codes[""]] = -1
+        self.size_order = np.argsort(sizes, kind="stable")
+        self.sorted_sizes = sizes[self.size_order]
+
+    @staticmethod
+    def build(gps: pd.Series, pfams: pd.Series) -> "PfamIndex":
+        """ It builds the index with vectorized pandas string operations.
+
+        Args:
+          * gps: gene names (or protein ids); gene synonyms are separated
+          by spaces, paralogs end with ";" and "null" rows are skipped
+          * pfams: pfam entries of gps such as "PF17047;PF00168;" or "null" """
+
+        frame = pd.DataFrame({"gp": gps.to_numpy(), "pfam": pfams.to_numpy()})
+        frame = frame[frame["gp"] != "null"].reset_index(drop=True)
+
+        # pfam key of each row: its domains are sorted and joined again
+        domains = frame["pfam"].str.split(";").explode()
+        domains = domains[(domains != "") & (domains != "null")]
+        domains = domains.reset_index().sort_values(["index", "pfam"])
+        row_keys = domains.groupby("index")["pfam"].agg(";".join)
+        frame["key"] = row_keys.reindex(frame.index, fill_value="")
+
+        # one member per gene synonym, later rows win as in a dict
+        synonyms = frame["gp"].str.split(" ").explode().str.rstrip(";")
+        members = pd.DataFrame({"member": synonyms, "key": frame["key"].reindex(synonyms.index)})
+        members = members[members["member"] != ""]
+        members = members.drop_duplicates("member", keep="last")
+
+        codes, keys = pd.factorize(members["key"])
+        order = np.argsort(codes, kind="stable")
+        member_names = members["member"].to_numpy()[order]
+        member_codes = codes[order]
+        indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(member_codes, minlength=len(keys)), out=indptr[1:])
+
+        # multi-label membership of single domains
+        single = pd.Series(keys[member_codes], dtype=object).str.split(";").explode()
+        single = single[single != ""]
+        domain_codes, domain_names = pd.factorize(single)
+        domain_order = np.argsort(domain_codes, kind="stable")
+        domain_members = single.index.to_numpy()[domain_order]
+        domain_indptr = np.zeros(len(domain_names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(domain_codes, minlength=len(domain_names)), out=domain_indptr[1:])
+
+        return PfamIndex(
+            member_names.astype(str),
+            np.asarray(keys, dtype=str),
+            indptr,
+            member_codes.astype(np.int32),
+            np.asarray(domain_names, dtype=str),
+            domain_indptr,
+            domain_members.astype(np.int32),
+            str(gps.name or ""),
+        )
+
+    def save(self, index_dir: str) -> None:
+        """It saves the index into a ".npz" file."""
+        np.savez(
+            index_dir,
+            members=self.members,
+            keys=self.keys,
+            indptr=self.indptr,
+            member_codes=self.member_codes,
+            domains=self.domains,
+            domain_indptr=self.domain_indptr,
+            domain_members=self.domain_members,
+            column=np.array(self.column),
+        )
+
+    @staticmethod
+    def load(index_dir: str) -> "PfamIndex":
+        with np.load(index_dir) as archive:
+            return PfamIndex(
+                archive["members"],
+                archive["keys"],
+                archive["indptr"],
+                archive["member_codes"],
+                archive["domains"],
+                archive["domain_indptr"],
+                archive["domain_members"],
+                str(archive["column"]) if "column" in archive.files else "",
+            )
+
+    def key_of(self, gp: str) -> str:
+        """It returns the pfam key of a gene/protein."""
+        return self.keys[self.member_codes[self.member_rows[gp]]]
+
+    def group(self, key: str) -> np.ndarray:
+        """It returns gene/protein names sharing a pfam key."""
+        code = self.key_codes[key]
+        return self.members[self.indptr[code]:self.indptr[code + 1]]
+
+    def domain(self, domain: str) -> np.ndarray:
+        """It returns gene/protein names having a single pfam domain."""
+        code = self.domain_codes[domain]
+        rows = self.domain_members[self.domain_indptr[code]:self.domain_indptr[code + 1]]
+        return self.members[rows]
+
+    def groups_larger_than(self, size: int) -> list[str]:
+        """It returns pfam keys of groups with at least size members,
+        from the largest group to the smallest."""
+        start = np.searchsorted(self.sorted_sizes, size, side="left")
+        return self.keys[self.size_order[start:][::-1]].tolist()
+
+    def group_sizes(self) -> pd.Series:
+        return pd.Series(np.diff(self.indptr), index=self.keys, name="size")
+
+    def __len__(self) -> int:
+        return len(self.members)
@@ -1,27 +1,35 @@
 from argparse import Namespace
-import numpy as np
 from pfam import Pfam
-from protein import load_embeds_pickle
+from embed_matrix import EmbeddingMatrix
 
 pfams_dir = "/Users/goktug/Desktop/Cancer-Research/data/genes_pfams.tsv"
 embeds_dir = "/Users/goktug/Desktop/Cancer-Research/data"
+matrix_dir = f"{embeds_dir}/prot_bert_embeds"
 
-protbert_embeds = load_embeds_pickle(embeds_dir, "prot_bert_embeds.p")
+# converting the pickle once into a memory-mapped matrix
+if not EmbeddingMatrix.exists(matrix_dir):
+    EmbeddingMatrix.from_pickle(embeds_dir, "prot_bert_embeds.p", matrix_dir)
+
+protbert_embeds = EmbeddingMatrix(matrix_dir)
 pfamily = Pfam(pfams_dir, "Gene")
 pfam_groups = pfamily.detect_large_pfams(120)
 
 print("Large Pfam Groups:")
 print(pfam_groups)
 
-query_genes = list(protbert_embeds.keys())
-query_embeds = np.array(list(protbert_embeds.values()))
+query_genes = list(protbert_embeds.genes)
+query_embeds = protbert_embeds.matrix
 
 config = Namespace()
 config.n_components = 2
 config.perplexity = 50
 config.init = "random"
 config.learning_rate = "auto"
+config.backend = "sklearn"
+config.pca_dim = 50
+config.n_jobs = -1
 
 target_pfams = ["PF00096;PF01352", "PF00069"]
 
-pfamily.apply_tsne(query_genes, query_embeds, config, target_pfams)
+pfamily.apply_tsne(query_genes, query_embeds, config, target_pfams,
+                   cache_dir=f"{embeds_dir}/projections")
@@ -0,0 +1,135 @@
+import os
+from typing import Optional
+
+import numpy as np
+import torch
+
+from batching import BatchEngine, scatter_batches
+from embed_cache import EmbeddingCache
+
+
+pooling_modes = ("mean", "cls", "max", "residue")
+
+
+def check_poolings(poolings: list[str], has_cls: bool) -> None:
+    for pooling in poolings:
+        if pooling not in pooling_modes:
+            raise ValueError(f"Pooling should be one of {pooling_modes}")
+    if "cls" in poolings and not has_cls:
+        raise ValueError("The model has no cls token")
+    if len(poolings) == 0:
+        raise ValueError("At least one pooling should be given")
+
+
+def pool_hidden(hidden: torch.Tensor, residue_mask: torch.Tensor, poolings: list[str]) -> dict:
+    """ It pools the hidden states of one batch in several ways at once.
+
+    * Reductions are weighted by residue_mask over the whole padded batch,
+    so padding and special tokens never contribute to mean/max outputs.
+    * Residue outputs are returned as a list of [length, D] cpu tensors.
+
+    Args:
+      - hidden: last hidden states in [B, T, D] shape
+      - residue_mask: True at residue tokens in [B, T] shape
+      - poolings: the requested outputs among pooling_modes"""
+
+    hidden = hidden.float()
+    outputs = {}
+
+    if "mean" in poolings:
+        weights = residue_mask.unsqueeze(-1).to(hidden.dtype)
+        outputs["mean"] = (hidden * weights).sum(dim=1) / weights.sum(dim=1).clamp(min=1.0)
+    if "max" in poolings:
+        outputs["max"] = hidden.masked_fill(~residue_mask.unsqueeze(-1), float("-inf")).amax(dim=1)
+    if "cls" in poolings:
+        outputs["cls"] = hidden[:, 0, :]
+    if "residue" in poolings:
+        outputs["residue"] = [hidden[i][residue_mask[i]].cpu() for i in range(len(hidden))]
+
+    return outputs
+
+
+class ResidueWriter:
+    """It streams per-residue embeddings into a memory-mapped file.
+
+    * Residues of all sequences are concatenated into "residues.npy" in
+    [total residues, D] shape; residues of sequence i are the rows
+    offsets[i]:offsets[i+1], where offsets are kept in "offsets.npy".
+    * The file is created on the first write, once D is known, and each
+    batch is written into its rows straight away."""
+
+    def __init__(self, residue_dir: str, lengths: list[int]) -> None:
+        os.makedirs(residue_dir, exist_ok=True)
+        self.residue_dir = residue_dir
+        self.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        np.save(os.path.join(residue_dir, "offsets.npy"), self.offsets)
+        self.residues: Optional[np.memmap] = None
+
+    def write(self, indices: np.ndarray, residues: list[torch.Tensor]) -> None:
+        if self.residues is None:
+            self.residues = np.lib.format.open_memmap(
+                os.path.join(self.residue_dir, "residues.npy"), mode="w+",
+                dtype=np.float32, shape=(int(self.offsets[-1]), residues[0].shape[1]))
+
+        for i, embeds in zip(indices, residues):
+            self.residues[self.offsets[i]:self.offsets[i + 1]] = embeds.numpy()
+
+    def close(self) -> None:
+        if self.residues is not None:
+            self.residues.flush()
+            self.residues = None
+
+    @staticmethod
+    def load(residue_dir: str) -> tuple[np.ndarray, np.ndarray]:
+        """It returns memory-mapped residue embeddings and their offsets."""
+        residues = np.load(os.path.join(residue_dir, "residues.npy"), mmap_mode="r")
+        offsets = np.load(os.path.join(residue_dir, "offsets.npy"))
+        return residues, offsets
+
+
+def embed_poolings(
+        engine: BatchEngine,
+        prot_seqs: list[str],
+        poolings: list[str],
+        residue_dir: Optional[str] = None,
+        cache: Optional[EmbeddingCache] = None,
+        ckpt_name: str = "",
+) -> dict[str, torch.Tensor]:
+
+    """ It computes several poolings of sequences with one forward pass.
+
+    * The forward function of engine should accept a poolings keyword
+    and return pool_hidden outputs.
+    * Without residue outputs, cached poolings are reused and only
+    sequences missing some of them reach the model.
+    * Residue outputs are written to residue_dir batch by batch, and are
+    read back with ResidueWriter.load.
+
+    Returns: a dict of pooling -> embeddings in [N, D] shape on cpu"""
+
+    pooled = [pooling for pooling in poolings if pooling != "residue"]
+
+    if "residue" not in poolings:
+        if cache is not None:
+            return cache.embed_many(
+                ckpt_name, pooled, prot_seqs, lambda seqs: engine.run(seqs, poolings=pooled))
+        return engine.run(prot_seqs, poolings=pooled)
+
+    if residue_dir is None:
+        raise ValueError("Residue embeddings need a residue_dir")
+
+    writer = ResidueWriter(residue_dir, [len(seq) for seq in prot_seqs])
+    indices, outputs = [], []
+    for batch, output in engine.iter_batches(prot_seqs, poolings=poolings):
+        writer.write(batch, output.pop("residue"))
+        indices.append(batch)
+        outputs.append({name: embeds.cpu() for name, embeds in output.items()})
+    writer.close()
+
+    embeds = {name: scatter_batches(indices, [output[name] for output in outputs]) for name in pooled}
+    if cache is not None:
+        for name in pooled:
+            keys = [EmbeddingCache.make_key(ckpt_name, name, seq) for seq in prot_seqs]
+            cache.put_many(keys, embeds[name].numpy())
+    return embeds
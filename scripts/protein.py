@@ -1,37 +1,148 @@
-import requests as r
+import os
+from bisect import bisect_left
+from typing import Optional
+
 import pandas as pd
 
+from uniprot import UniProtClient
 from utils import (
     is_string,
     prot_headers,
-    base_query_url
 )
 
+try:
+    import pyarrow.parquet
+    string_dtype = "string[pyarrow]"
+except ImportError:
+    pyarrow = None
+    string_dtype = "string"
+
+# low-cardinality columns of uniprot entries
+category_columns = ["Organism", "Taxonomy", "PE", "SV"]
+
 
 class ProteinDB:
 
     def __init__(
             self,
             database_tsv_dir: str,
+            cache_dir: Optional[str] = None,
+            lazy_sequence: bool = False,
     ) -> None:
 
         """ It defines protein database.
+
+        * Low-cardinality columns (Organism, Taxonomy, PE, SV) are stored as
+        categoricals and the other columns as pyarrow-backed strings, which
+        are much smaller than object arrays of Python strings.
+        * On first load, the parsed database is written to a parquet cache,
+        which is read instead of the tsv file afterwards. The cache is
+        rebuilt when the tsv file is newer. Caching requires pyarrow.
+
         Args:
           database_tsv_dir: the directory of tsv file containing protein entries [1]
+          cache_dir: the directory of parquet cache, next to tsv file by default
+          lazy_sequence: if True, Sequence column is not loaded until
+          load_sequences() is called.
 
         [1]: https://www.uniprot.org/proteomes/UP000005640
         """
 
-        database = pd.read_csv(
+        self.database_tsv_dir = database_tsv_dir
+        self.cache_dir = cache_dir or f"{os.path.splitext(database_tsv_dir)[0]}.parquet"
+
+        if self._is_cache_valid():
+            columns = None
+            if lazy_sequence:
+                schema = pyarrow.parquet.read_schema(self.cache_dir)
+                columns = [name for name in schema.names if name != "Sequence"]
+            database = pd.read_parquet(self.cache_dir, columns=columns)
+        else:
+            database = ProteinDB.read_tsv(database_tsv_dir).set_index("ID")
+            if pyarrow is not None:
+                database.to_parquet(self.cache_dir)
+            if lazy_sequence:
+                database = database.drop(columns="Sequence")
+
+        # database["Gene"] = [gene.split(" ")[0] for gene in database.iloc[:]["Gene"]]
+        self.database = database
+
+        self.uniprot_client: Optional[UniProtClient] = None
+
+        # gene name and synonym -> row positions
+        self.gene_index: dict[str, list[int]] = {}
+        self.gene_keys: Optional[list[str]] = None
+        self._index_genes(self.database["Gene"], 0)
+
+    @staticmethod
+    def read_tsv(database_tsv_dir: str) -> pd.DataFrame:
+        """It parses tsv file of protein entries with compact dtypes."""
+
+        header = pd.read_csv(database_tsv_dir, sep="\t", nrows=0).columns
+        dtypes = {name: "category" if name in category_columns else string_dtype
+                  for name in header}
+
+        return pd.read_csv(
             database_tsv_dir,
             sep="\t",
-            dtype=str,
+            dtype=dtypes,
             na_filter=False,
             keep_default_na=False
         )
 
-        # database["Gene"] = [gene.split(" ")[0] for gene in database.iloc[:]["Gene"]]
-        self.database = pd.DataFrame(database).set_index("ID")
+    def _is_cache_valid(self) -> bool:
+        if pyarrow is None or not os.path.exists(self.cache_dir):
+            return False
+        return os.path.getmtime(self.cache_dir) >= os.path.getmtime(self.database_tsv_dir)
+
+    def load_sequences(self) -> None:
+        """It loads Sequence column if the database is created lazily.
+
+        * Entries appended from UniProt may already bring their sequences,
+        so only missing sequences are filled from the database file."""
+
+        existing = self.database.get("Sequence")
+        if existing is not None and not existing.isna().any():
+            return
+
+        if self._is_cache_valid():
+            sequences = pd.read_parquet(self.cache_dir, columns=["Sequence"])["Sequence"]
+        else:
+            sequences = pd.read_csv(
+                self.database_tsv_dir,
+                sep="\t",
+                usecols=["ID", "Sequence"],
+                dtype=string_dtype,
+                na_filter=False,
+                keep_default_na=False
+            ).set_index("ID")["Sequence"]
+
+        sequences = sequences.reindex(self.database.index)
+        if existing is not None:
+            sequences = existing.where(existing.notna(), sequences.to_numpy())
+        self.database["Sequence"] = sequences.astype(string_dtype)
+
+    def _index_genes(self, genes: pd.Series, offset: int) -> None:
+        """It adds gene names of new rows to the inverted gene index.
+
+        * Gene column can hold several synonyms of one gene separated by
+        space or semicolon (e.g. "DEFB104A; DEFB104B"). Each synonym is
+        indexed separately in upper case.
+
+        Args:
+          genes: Gene column of the rows to be indexed.
+          offset: row position of the first gene in the database."""
+
+        synonyms = genes.str.upper().str.replace(";", " ", regex=False).str.split()
+        synonyms = synonyms.reset_index(drop=True).explode().dropna()
+
+        for pos, gene in zip(synonyms.index.to_numpy() + offset, synonyms.values):
+            rows = self.gene_index.setdefault(gene, [])
+            if not rows or rows[-1] != pos:
+                rows.append(int(pos))
+
+        # sorted keys for prefix search are rebuilt on demand
+        self.gene_keys = None
 
     def search_uniprot_id(self, uniprot_id: str) -> pd.DataFrame:
         """It returns sequence, gene, and description of target protein.
@@ -51,7 +162,48 @@ class ProteinDB:
 
         if uniprot_id not in self.database.index:
             raise ValueError("Invalid uniprot id for proteome database")
-        return self.database.loc[uniprot_id].to_frame().T
+        return self.database.loc[[uniprot_id]]
+
+    def search_uniprot_ids(
+            self,
+            uniprot_ids: list[str],
+            columns: Optional[list[str]] = None,
+            as_array: bool = False,
+    ) -> tuple:
+        """It returns protein entries of many uniprot ids in one call.
+
+        * The ids are resolved together through index reindexing instead
+        of one DataFrame lookup per id. Unknown ids do not raise an error,
+        they are returned as a set.
+
+        Args:
+          uniprot_ids: a list of uniprot ids in string format.
+          columns: the columns to be returned, all columns by default.
+          as_array: if True, a numpy array is returned instead of DataFrame;
+          an array of one column (e.g. ["Sequence"]) is flattened.
+
+        Returns: found entries in the order of given ids and a set of
+        missing ids.
+        """
+
+        query = pd.Index(uniprot_ids, dtype=str).str.upper().astype(self.database.index.dtype)
+        positions = self.database.index.get_indexer(query)
+        found = positions >= 0
+        # missing ids are reported as the caller spelled them
+        missing = {uid for uid, is_found in zip(uniprot_ids, found) if not is_found}
+
+        if columns is None:
+            entries = self.database.iloc[positions[found]]
+        else:
+            invalid = [name for name in columns if name not in self.database.columns]
+            if invalid:
+                raise ValueError(f"Invalid column names exist: {invalid}")
+            entries = self.database.iloc[positions[found]][columns]
+
+        if as_array:
+            array = entries.to_numpy()
+            return (array[:, 0] if array.shape[1] == 1 else array), missing
+        return entries, missing
 
     def search_gene(self, gene_name: str) -> pd.DataFrame:
         """It returns uniprot id, sequence, and description of target protein.
@@ -62,6 +214,9 @@ class ProteinDB:
         alternative splicing such as AKAP7. Hence, all proteins matched with
         given gene name are returned as a DataFrame object.
 
+        * Gene names and their synonyms are matched exactly through an
+        inverted index, so "AKAP7" does not match other genes containing it.
+
         Args:
           gene_name: gene name in string format.
 
@@ -70,24 +225,71 @@ class ProteinDB:
 
         is_string(gene_name)
         gene_name = gene_name.upper()
-        genes_list = self.database["Gene"].to_list()
 
-        indices = []
-        for i, gene in enumerate(genes_list):
-            if gene_name in gene:
-                indices.append(i)
-        if len(indices) == 0:
+        if gene_name not in self.gene_index:
             raise ValueError("Invalid gene name for proteome database")
+        return self.database.iloc[self.gene_index[gene_name]]
+
+    def search_genes(self, gene_names: list[str]) -> tuple[pd.DataFrame, set]:
+        """It returns protein entries of many gene names in one call.
+
+        * A "Query" column is added to the returned DataFrame to tell
+        which gene name each protein entry is matched with.
+
+        Args:
+          gene_names: a list of gene names in string format.
+
+        Returns: a DataFrame of matched entries and a set of unknown genes.
+        """
+
+        positions, queries = [], []
+        missing = set()
+
+        for gene_name in gene_names:
+            rows = self.gene_index.get(gene_name.upper())
+            if rows is None:
+                missing.add(gene_name)
+                continue
+            positions.extend(rows)
+            queries.extend([gene_name] * len(rows))
+
+        entries = self.database.iloc[positions].copy()
+        entries.insert(0, "Query", queries)
+        return entries, missing
 
-        return self.database.iloc[indices]
+    def search_gene_prefix(self, prefix: str) -> pd.DataFrame:
+        """It returns protein entries whose gene names start with prefix.
+
+        * The lookup is a binary search over sorted gene names, and
+        results are ordered by gene name (e.g. "AKAP" -> AKAP1, AKAP10, ...).
+
+        Args:
+          prefix: the beginning of gene names in string format.
+        """
+
+        is_string(prefix)
+        prefix = prefix.upper()
+
+        if self.gene_keys is None:
+            self.gene_keys = sorted(self.gene_index)
+
+        positions: list[int] = []
+        start = bisect_left(self.gene_keys, prefix)
+        for gene in self.gene_keys[start:]:
+            if not gene.startswith(prefix):
+                break
+            positions.extend(self.gene_index[gene])
+
+        # synonyms of one gene can share the same rows
+        return self.database.iloc[list(dict.fromkeys(positions))]
 
     def query_to_uniprot(self, uniprot_id: str, fields: list) -> pd.DataFrame:
         """ Fetches a protein entry from uniprot and save it to database.
 
         * The function sends a query to UniProt to search for particular
         uniprot id. If it exists, the response of the request
-        is converted to fasta and parsed into a new protein entry, which
-        is saved into protein database.
+        is parsed into a new protein entry, which is saved into
+        protein database.
 
         Args:
           uniprot_id: uniprot id in string format.
@@ -97,32 +299,90 @@ class ProteinDB:
 
         """
 
-        # creating query url
-        format = "tsv"
-        query = f"accession:{uniprot_id}"
-        fields_tag = ",".join(fields)
-        query_url = f"{base_query_url}query={query}&format={format}&fields={fields_tag}"
-        print(query_url)
-
-        # sending query for response
-        response = r.post(query_url)
-        if response.status_code == 404:
+        entries = self.query_many_to_uniprot([uniprot_id], fields)
+        if len(entries) == 0:
             raise ValueError("Invalid uniprot id is passed as input argument")
+        return entries
+
+    def query_many_to_uniprot(
+            self,
+            uniprot_ids: list[str],
+            fields: list,
+            client: Optional[UniProtClient] = None,
+    ) -> pd.DataFrame:
+
+        """ Fetches many protein entries from uniprot and save them to database.
 
-        # In query response,
-        # headers and entries are located in different lines.
-        # there is tab char between entries and headers.
-        # we fetch headers and entries separately.
-        headers = response.text.split("\n")[0].split("\t")
-        headers = [prot_headers[h] for h in headers]  # query headers to our headers
-        entries = response.text.split("\n")[1].split("\t")
+        * Ids already in the database are not fetched again. The others are
+        requested in batches over one pooled session, and all new entries
+        are appended to the database at once.
 
-        # Adding new entry to protein database
-        outcome = dict(zip(headers, entries))
-        df_entry = pd.DataFrame(outcome, index=[uniprot_id])
-        self.database = pd.concat([self.database, df_entry])
+        Args:
+          uniprot_ids: a list of uniprot ids in string format.
+          fields: UniProt return fields, e.g. utils.default_fields
+          client: a UniProt client (or one to a local server), a shared
+          client of the database by default.
+
+        Returns: a DataFrame of requested entries found in UniProt.
+        """
 
-        return df_entry
+        if client is None:
+            if self.uniprot_client is None:
+                self.uniprot_client = UniProtClient()
+            client = self.uniprot_client
+
+        uniprot_ids = list(dict.fromkeys(uid.upper() for uid in uniprot_ids))
+        new_ids = [uid for uid in uniprot_ids if uid not in self.database.index]
+
+        # entries are keyed by their accession, and a secondary (merged)
+        # accession is answered with the entry of its primary accession
+        query_fields = ["accession", "sec_acc"] + [f for f in fields if f not in ("accession", "sec_acc")]
+        primary = {uid: uid for uid in uniprot_ids if uid in self.database.index}
+
+        requested = set(new_ids)
+        rows = []
+        for entry in client.fetch(new_ids, query_fields):
+            secondary = entry.get("Secondary accession", "")
+            for acc in [entry["Entry"]] + [acc.strip() for acc in secondary.split(";")]:
+                if acc in requested:
+                    primary.setdefault(acc, entry["Entry"])
+
+            if "sec_acc" not in fields:
+                entry.pop("Secondary accession", None)
+            # query headers to our headers
+            rows.append({prot_headers.get(h, h): v for h, v in entry.items()})
+
+        if rows:
+            self._append_entries(pd.DataFrame(rows).set_index("ID"))
+
+        found = [primary[uid] for uid in uniprot_ids if uid in primary]
+        return self.database.loc[list(dict.fromkeys(found))]
+
+    def _append_entries(self, entries: pd.DataFrame) -> None:
+        """It appends new entries to the database in one concatenation.
+
+        * New entries are cast to the dtypes of the database, and the
+        categories of categorical columns are merged."""
+
+        entries = entries[~entries.index.duplicated()]
+        entries = entries[~entries.index.isin(self.database.index)]
+        if len(entries) == 0:
+            return
+
+        offset = len(self.database)
+        database = pd.concat([self.database, entries])
+
+        for name, dtype in self.database.dtypes.items():
+            if name not in entries.columns:
+                continue
+            if isinstance(dtype, pd.CategoricalDtype):
+                database[name] = database[name].astype("category")
+            else:
+                database[name] = database[name].astype(dtype)
+
+        self.database = database
+        if "Gene" in entries.columns:
+            self._index_genes(entries["Gene"], offset)
 
     def save_columns(self, columns: list, save_dir: str, index: bool) -> None:
 
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+from argparse import Namespace
+from typing import Optional
+
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.manifold import TSNE
+
+
+backends = ("sklearn", "opentsne", "umap", "pca")
+
+
+def reduction_config(config: Namespace) -> dict:
+    """ It fills the reduction config with defaults.
+
+    * Beyond the TSNE fields (n_components, perplexity, init, learning_rate),
+    config can choose:
+        - backend: "sklearn" (Barnes-Hut TSNE), "opentsne" (FFT-accelerated
+        TSNE), "umap" or "pca"
+        - pca_dim: PCA pre-reduction dimension, None to skip it
+        - n_jobs: the number of threads, -1 for all cores
+        - random_state: the seed of the projection
+        - n_neighbors, min_dist: UMAP parameters """
+
+    params = {
+        "backend": getattr(config, "backend", "sklearn"),
+        "n_components": config.n_components,
+        "perplexity": getattr(config, "perplexity", 30),
+        "init": getattr(config, "init", "pca"),
+        "learning_rate": getattr(config, "learning_rate", "auto"),
+        "pca_dim": getattr(config, "pca_dim", 50),
+        "n_jobs": getattr(config, "n_jobs", -1),
+        "random_state": getattr(config, "random_state", 0),
+        "n_neighbors": getattr(config, "n_neighbors", 15),
+        "min_dist": getattr(config, "min_dist", 0.1),
+    }
+
+    if params["backend"] not in backends:
+        raise ValueError(f"Reduction backend should be one of {backends}")
+    return params
+
+
+def embeds_hash(embeds: np.ndarray) -> str:
+    """ It hashes an embedding matrix without copying a contiguous one."""
+
+    digest = hashlib.sha256()
+    digest.update(str((embeds.shape, embeds.dtype.str)).encode())
+    digest.update(np.ascontiguousarray(embeds).data)
+    return digest.hexdigest()
+
+
+def project(embeds: np.ndarray, params: dict) -> np.ndarray:
+    """ It projects embeddings onto 2/3D coordinates."""
+
+    n_components = params["n_components"]
+    data = np.asarray(embeds, dtype=np.float32)
+
+    if params["backend"] == "pca":
+        return PCA(n_components=n_components,
+                   random_state=params["random_state"]).fit_transform(data)
+
+    # PCA pre-reduction removes noise dimensions and speeds up neighbors search
+    pca_dim = params["pca_dim"]
+    if pca_dim is not None and pca_dim < min(data.shape):
+        data = PCA(n_components=pca_dim, random_state=params["random_state"]).fit_transform(data)
+
+    if params["backend"] == "sklearn":
+        tsne = TSNE(n_components=n_components,
+                    perplexity=params["perplexity"],
+                    init=params["init"],
+                    learning_rate=params["learning_rate"],
+                    method="barnes_hut",
+                    n_jobs=params["n_jobs"],
+                    random_state=params["random_state"])
+        return tsne.fit_transform(data)
+
+    if params["backend"] == "opentsne":
+        from openTSNE import TSNE as OpenTSNE
+
+        # FFT interpolation of openTSNE supports up to 2 components
+        tsne = OpenTSNE(n_components=n_components,
+                        perplexity=params["perplexity"],
+                        initialization=params["init"],
+                        learning_rate=params["learning_rate"],
+                        negative_gradient_method="fft" if n_components <= 2 else "bh",
+                        n_jobs=params["n_jobs"],
+                        random_state=params["random_state"])
+        return np.asarray(tsne.fit(data))
+
+    import umap
+
+    reducer = umap.UMAP(n_components=n_components,
+                        n_neighbors=params["n_neighbors"],
+                        min_dist=params["min_dist"],
+                        n_jobs=params["n_jobs"],
+                        random_state=params["random_state"])
+    return reducer.fit_transform(data)
+
+
+def reduce_embeds(
+        embeds: np.ndarray,
+        config: Namespace,
+        cache_dir: Optional[str] = None,
+) -> np.ndarray:
+
+    """ It reduces embeddings to 2/3D coordinates with a chosen backend.
+
+    * If cache_dir is given, coordinates are saved under a hash of the
+    embeddings and reduction config, and later calls with the same
+    embeddings and config load them instead of fitting again.
+
+    Args:
+      - embeds: embedding matrix in [N, D] shape
+      - config: reduction config, see reduction_config
+      - cache_dir: the directory of cached coordinates
+
+    Returns: coordinates in [N, n_components] shape"""
+
+    params = reduction_config(config)
+    if cache_dir is None:
+        return project(embeds, params)
+
+    key = hashlib.sha256(
+        (embeds_hash(embeds) + json.dumps(params, sort_keys=True)).encode()).hexdigest()[:16]
+    coords_dir = os.path.join(cache_dir, f"proj_{params['backend']}_{key}.npy")
+
+    if os.path.exists(coords_dir):
+        return np.load(coords_dir)
+
+    coords = project(embeds, params)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(coords_dir, coords)
+    return coords
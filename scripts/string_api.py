@@ -0,0 +1,119 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from http_cache import ResponseCache
+
+from utils import (
+    string_api_url,
+    network_params,
+    read_unknown_prots,
+    parse_network,
+)
+
+
+class RateLimiter:
+    """It spaces out requests shared by many threads.
+
+    * STRING asks its users to wait one second between consecutive calls.
+    Each caller of wait() is given the next free time slot, so that no
+    more than "rate" requests per second are started."""
+
+    def __init__(self, rate: float = 1.0) -> None:
+        """
+        Args:
+          - rate: the upper bound of requests per second"""
+
+        if rate <= 0:
+            raise ValueError("rate should be positive")
+
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def network_many(
+        method_name: str,
+        query_sets: list[list],
+        species: int,
+        network_type: str,
+        confidence: float,
+        add_color_nodes: int,
+        unk_prots_dir: str = "",
+        output_format: str = "tsv-no-header",
+        max_workers: int = 4,
+        rate: float = 1.0,
+        api_url: str = string_api_url,
+        timeout: float = 60.0,
+        session: Optional[requests.Session] = None,
+        cache: Optional[ResponseCache] = None,
+) -> Iterator[tuple]:
+
+    """It searches many gene sets in STRING database concurrently.
+
+    * This is the batch variant of utils.network. Each query set (e.g. the
+    targets of one drug panel) is sent as a separate request. Requests run
+    in a thread pool over one pooled session, and a rate limiter keeps
+    them within the usage limits of STRING.
+    * Results are yielded as soon as they complete, not in input order.
+
+    Args:
+      - method_name: the name of function in STRING-API to be used ("network")
+      - query_sets: a list of gene name lists, one PPI graph per list
+      - species: NCBI taxonomoy id for that species (9606 for human)
+      - network_type: the type of network, either "functional" or "physical"
+      - confidence: (50-1000) less confidence score, more connection between the proteins
+      - add_color_nodes: N number of additional genes to interact with query genes
+      - unk_prots_dir: the directory of the file to include the names of the genes
+      that will be excluded from PPI graph
+      - max_workers: the upper bound of concurrent requests
+      - rate: the upper bound of requests started per second
+      - api_url: the url of STRING API (or a local mock server)
+      - timeout: seconds to wait for the server to respond
+      - session: a requests session to be reused, a new one by default
+      - cache: a response cache; cached query sets are not rate limited
+
+    Yields: (index of query set, nodes, edges) triplets """
+
+    unknown_prots = read_unknown_prots(unk_prots_dir)
+    request_url = "/".join([api_url, output_format, method_name])
+    limiter = RateLimiter(rate)
+
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+    def post(params: dict) -> str:
+        limiter.wait()
+        response = session.post(request_url, data=params, timeout=timeout)
+        response.raise_for_status()
+        return response.text
+
+    def fetch(query_genes: list) -> tuple:
+        params = network_params(query_genes, species, network_type,
+                                confidence, add_color_nodes)
+        if cache is None:
+            text = post(params)
+        else:
+            text = cache.fetch(request_url, params, lambda: post(params))
+        return parse_network(text, unknown_prots)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch, genes): i for i, genes in enumerate(query_sets)}
+        for future in as_completed(futures):
+            nodes, edges = future.result()
+            yield futures[future], nodes, edges
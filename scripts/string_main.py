@@ -3,9 +3,13 @@ from utils import network
 from networks import PPI
 from protein import ProteinDB
 from embedder import ProtTransEmbedder
+from embed_cache import EmbeddingCache
+from http_cache import ResponseCache
 
 ppi_graphs = "/Users/goktug/Desktop/Cancer-Research/ppi_graphs"
 prot_db_dir = "./data/human_proteome_reviewed.tsv"
+embeds_cache_dir = "./data/embeds_cache.sqlite"
+api_cache_dir = "./data/api_cache.sqlite"
 
 # creating PPI and ProteinDB objects
 ppi = PPI()
@@ -19,7 +23,8 @@ shoc2 = protein_db.search_gene("SHOC2")
 mras_seq = mras["Sequence"].values[0]
 shoc2_seq = mras["Sequence"].values[0]
 
-prot_trans = ProtTransEmbedder(device="cpu")
+embeds_cache = EmbeddingCache(embeds_cache_dir, max_bytes=2 * 1024 ** 3)
+prot_trans = ProtTransEmbedder(device="cpu", cache=embeds_cache)
 embeds = prot_trans.compute_res_embeds([mras_seq, shoc2_seq])
 print(embeds.shape)
 
@@ -32,6 +37,7 @@ nodes, edges = network(
     network_type="functional",
     confidence=350.0,
     add_color_nodes=5,
+    cache=ResponseCache(api_cache_dir),
 )
 
 ppi.add_nodes(nodes)
@@ -0,0 +1,116 @@
+from typing import Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from http_cache import ResponseCache
+from utils import uniprot_stream_url
+
+
+class UniProtClient:
+    """It fetches UniProt entries over a pooled and retrying session.
+
+    * Accessions are sent in batches as one "accession:A OR accession:B"
+    query to the stream endpoint, instead of one request per accession.
+    * Failed requests (connection errors, 429 and 5xx responses) are
+    retried with exponential backoff.
+    * Responses are parsed line by line while they are downloaded."""
+
+    def __init__(
+            self,
+            base_url: str = uniprot_stream_url,
+            batch_size: int = 100,
+            max_retries: int = 5,
+            backoff_factor: float = 0.5,
+            timeout: float = 30.0,
+            session: Optional[requests.Session] = None,
+            cache: Optional[ResponseCache] = None,
+    ) -> None:
+
+        """
+        Args:
+          - base_url: the url of UniProt stream endpoint (or a local stand-in)
+          - batch_size: the number of accessions in one query
+          - max_retries: the number of retries of a failed request
+          - backoff_factor: the base of exponential waiting between retries
+          - timeout: seconds to wait for the server to respond
+          - session: a requests session to be reused, a new one with retries
+          by default
+          - cache: a response cache to skip identical requests"""
+
+        self.base_url = base_url
+        self.cache = cache
+        self.batch_size = batch_size
+        self.timeout = timeout
+
+        # a session of the caller keeps its own adapters
+        if session is None:
+            retry = Retry(
+                total=max_retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET", "POST"],
+            )
+            session = requests.Session()
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=4)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def fetch(self, accessions: list[str], fields: list[str]) -> Iterator[dict]:
+        """It yields UniProt entries of given accessions.
+
+        * Each entry is a dict of UniProt headers to values, e.g.
+        {"Entry": "P02340", "Gene Names (primary)": "Tp53", ...}.
+        Unknown accessions are simply absent in the output.
+
+        Args:
+          - accessions: uniprot ids in string format
+          - fields: UniProt return fields [1]
+
+        [1]: https://www.uniprot.org/help/return_fields
+        """
+
+        for i in range(0, len(accessions), self.batch_size):
+            batch = accessions[i:i + self.batch_size]
+            query = " OR ".join(f"accession:{acc}" for acc in batch)
+            params = {"query": f"({query})", "format": "tsv", "fields": ",".join(fields)}
+
+            if self.cache is None:
+                yield from UniProtClient.parse_tsv(self._stream(params))
+                continue
+
+            # accessions are sorted in the key, so that their order does not matter
+            key_params = {"accession": batch, "format": "tsv", "fields": params["fields"]}
+            body = self.cache.fetch(self.base_url, key_params,
+                                    lambda: "\n".join(self._stream(params)))
+            yield from UniProtClient.parse_tsv(body.split("\n"))
+
+    def _stream(self, params: dict) -> Iterator[str]:
+        """It yields the lines of a UniProt response while downloading it."""
+
+        with self.session.get(self.base_url, params=params,
+                              timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            response.encoding = response.encoding or "utf-8"
+            yield from response.iter_lines(decode_unicode=True)
+
+    @staticmethod
+    def parse_tsv(lines) -> Iterator[dict]:
+        """It parses tsv lines of a UniProt response into entries.
+
+        * The first line holds headers, each following line one entry."""
+
+        headers = None
+        for line in lines:
+            if not line:
+                continue
+            values = line.split("\t")
+            if headers is None:
+                headers = values
+                continue
+            yield dict(zip(headers, values))
+
+    def close(self) -> None:
+        self.session.close()
@@ -1,11 +1,21 @@
+import gzip
+import io
+import math
 import os
+import re
+import sys
 import pickle
+from typing import Iterable, Iterator, Optional
+
 import numpy as np
 import requests
 
+from http_cache import ResponseCache
+
 string_api_url = "https://version-12-0.string-db.org/api"
 base_pfam_url = "https://www.ebi.ac.uk/interpro/api/entry/pfam"
 base_query_url = "https://rest.uniprot.org/uniprotkb/search?"
+uniprot_stream_url = "https://rest.uniprot.org/uniprotkb/stream"
 
 prot_headers = {"Entry": "ID",
                 "Entry Name": "Entry Name",
@@ -71,6 +81,15 @@ def has_selenocysteine(seq: str) -> bool:
     return "U" in seq
 
 
+def clean_sequence(seq: str) -> str:
+    """Maps rare amino acids (U, Z, O, B) to X as the embedders expect.
+
+    Args:
+      seq: primary structure of a protein in str format
+    """
+    return re.sub(r"[UZOB]", "X", seq)
+
+
 def index_pfams(pfams: list, index_type: str = "int") -> dict:
 
     if index_type == "color":
@@ -91,12 +110,56 @@ def index_pfams(pfams: list, index_type: str = "int") -> dict:
     return pfam_dict
 
 
-def generate_colors() -> np.ndarray:
+class ColorAllocator:
+    """It assigns distinct RGB colors to indices on demand.
+
+    * Colors come from a bijective permutation of the color cube
+    [0, max_val)^3: index i is mapped to (a * i) mod max_val^3, which is
+    then split into R, G and B digits in base max_val. Since a is coprime
+    to max_val^3, no two indices share a color.
+    * a is chosen close to the golden ratio of the cube size, so that
+    consecutive indices land far away from each other in the cube.
+    * Nothing is materialized: memory is O(1) and colors are the same in
+    every run for the same seed, which keeps plots reproducible."""
+
+    golden_ratio = (math.sqrt(5) - 1) / 2
+
+    def __init__(self, max_val: int = 256, seed: int = 0, skip_black: bool = False) -> None:
+        """
+        Args:
+          - max_val: colors have channel values in [0, max_val)
+          - seed: another seed gives another permutation
+          - skip_black: if True, black (0, 0, 0) is never assigned"""
+
+        self.max_val = max_val
+        self.size = max_val ** 3
+        self.offset = 1 if skip_black else 0
+
+        fraction = (ColorAllocator.golden_ratio * (seed + 1)) % 1.0
+        multiplier = max(int(self.size * fraction), 1)
+        while math.gcd(multiplier, self.size) != 1:
+            multiplier += 1
+        self.multiplier = multiplier
+
+    def __getitem__(self, index) -> np.ndarray:
+        """It returns a [3] color of an index, or [N, 3] colors of an index array."""
+
+        codes = np.asarray(index, dtype=np.int64) + self.offset
+        if np.any(codes < self.offset) or np.any(codes >= self.size):
+            raise IndexError("Color index is out of the color cube")
 
-    colors = np.indices((256, 256, 256), dtype=np.uint8)
-    colors = colors.reshape(3, -1).T
-    np.random.shuffle(colors)
-    return colors
+        codes = (codes * self.multiplier) % self.size
+        m = self.max_val
+        rgb = np.stack([codes // (m * m), (codes // m) % m, codes % m], axis=-1)
+        return rgb.astype(np.uint8)
+
+    def __len__(self) -> int:
+        return self.size - self.offset
+
+
+def generate_colors() -> ColorAllocator:
+    """It returns a lazy allocator over all 256^3 colors."""
+    return ColorAllocator(256)
 
 
 def network(
@@ -107,7 +170,9 @@ def network(
         confidence: float,
         add_color_nodes: int,
         unk_prots_dir: str = "",
-        output_format: str = "tsv-no-header"
+        output_format: str = "tsv-no-header",
+        cache: Optional[ResponseCache] = None,
+        timeout: float = 60.0,
 ) -> tuple:
 
     """It searches genes in STRING databse for PPI graphs.
@@ -131,9 +196,44 @@ def network(
       - confidence: (50-1000) less confidence score, more connection between the proteins
       - add_color_nodes: N number of additional genes to interact with query genes
       - unk_prots_dir: the directory of the file to include the names of the genes
-      that will be excluded from PPI graph """
+      that will be excluded from PPI graph
+      - cache: a response cache to skip identical requests
+      - timeout: seconds to wait for STRING API """
+
+    params = network_params(query_genes, species, network_type, confidence, add_color_nodes)
+
+    # sending a request to STRING API
+    request_url = "/".join([string_api_url, output_format, method_name])
+    unknown_prots = read_unknown_prots(unk_prots_dir)
+
+    def post() -> str:
+        # error responses raise here, so they never reach the cache
+        response = requests.post(request_url, data=params, timeout=timeout)
+        response.raise_for_status()
+        return response.text
+
+    if cache is not None:
+        text = cache.fetch(request_url, params, post)
+        return parse_network(text, unknown_prots)
+
+    # parsing the response while it is downloaded
+    with requests.post(request_url, data=params, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        response.encoding = response.encoding or "utf-8"
+        lines = response.iter_lines(decode_unicode=True)
+        return collect_network(iter_network_edges(lines, unknown_prots))
+
+
+def network_params(
+        query_genes: list,
+        species: int,
+        network_type: str,
+        confidence: float,
+        add_color_nodes: int,
+) -> dict:
+    """It builds the parameters of a STRING network request."""
 
-    params = {
+    return {
         "identifiers": "%0d".join(query_genes),
         "species": species,
         "network_type": network_type,
@@ -142,29 +242,96 @@ def network(
         "caller_identity": "www.awesome_app.org"
     }
 
-    # sending a request to STRING API
-    request_url = "/".join([string_api_url, output_format, method_name])
-    response = requests.post(request_url, data=params)
 
-    # reading unknown proteins into a set
+def read_unknown_prots(unk_prots_dir: str = "") -> set:
+    """It reads the names of proteins to be excluded from PPI graphs."""
+
     if unk_prots_dir != "":
         with open(unk_prots_dir, "r") as file:
-            unknown_prots = set([line.rstrip() for line in file])
-    else:
-        unknown_prots = set()
+            return set([line.rstrip() for line in file])
+    return set()
+
+
+def parse_network(text: str, unknown_prots: set) -> tuple:
+    """It parses a tsv STRING response into nodes and edges.
+
+    Args:
+      - text: the body of STRING response in "tsv-no-header" format
+      - unknown_prots: the names of proteins excluded from PPI graph """
+
+    return collect_network(iter_network_edges(io.StringIO(text), unknown_prots))
+
+
+def collect_network(records: Iterable[tuple]) -> tuple:
+    """It gathers edge records into a set of nodes and a list of edges."""
 
     edges: list[list] = []
     nodes: set[str] = set()
 
-    for line in response.text.strip().split("\n"):
+    for node1, node2, edge_score in records:
+        nodes.update([node1, node2])
+        edges.append([node1, node2, edge_score])
+
+    return nodes, edges
+
+
+def iter_network_edges(lines: Iterable[str], unknown_prots: set) -> Iterator[tuple]:
+    """It parses STRING network lines into edge records one by one.
+
+    * Lines can come from a streamed response or a file, so that the
+    whole payload is never held in memory. Node names are interned, since
+    the same proteins appear in many edges.
+
+    Args:
+      - lines: lines of STRING network in "tsv-no-header" format
+      - unknown_prots: the names of proteins excluded from PPI graph
+
+    Yields: (node1, node2, score) with score in [0, 1] as float """
+
+    for line in lines:
         line = line.strip().split("\t")
 
         if len(line) == 1 and line[0] == "":
             continue
 
-        node1, node2, edge_score = line[2], line[3], line[5]
+        node1, node2 = line[2], line[3]
         if (node1 not in unknown_prots) and (node2 not in unknown_prots):
-            nodes.update([node1, node2])
-            edges.append([node1, node2, edge_score])
+            yield sys.intern(node1), sys.intern(node2), float(line[5])
 
-    return nodes, edges
+
+def iter_links_file(
+        links_dir: str,
+        unknown_prots: Optional[set] = None,
+        min_score: float = 0.0,
+) -> Iterator[tuple]:
+
+    """It streams edge records from a STRING bulk "protein.links" file.
+
+    * Bulk files (e.g. 9606.protein.links.v12.0.txt.gz) have a header line
+    and space-separated "protein1 protein2 combined_score" lines, where
+    scores are in 0-1000. Scores are scaled into [0, 1] as in API responses.
+    Gzipped files are read without decompressing them on disk.
+
+    Args:
+      - links_dir: the directory of protein links file (.txt or .txt.gz)
+      - unknown_prots: the names of proteins excluded from PPI graph
+      - min_score: edges below this score in [0, 1] are skipped
+
+    Yields: (node1, node2, score) with score in [0, 1] as float """
+
+    unknown_prots = unknown_prots or set()
+    opener = gzip.open if links_dir.endswith(".gz") else open
+
+    with opener(links_dir, "rt") as file:
+        next(file, None)  # header
+        for line in file:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+
+            node1, node2 = fields[0], fields[1]
+            score = float(fields[-1]) / 1000.0
+            if score < min_score:
+                continue
+            if (node1 not in unknown_prots) and (node2 not in unknown_prots):
+                yield sys.intern(node1), sys.intern(node2), score